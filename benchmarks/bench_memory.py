@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Benchmark how many rooms fit in memory, and how fast they are built.
+
+Creates rooms through the same calls the HTTP handlers make (create_room,
+add_player, start_game, then responses and votes), with six players each,
+spread over the lobby, response, voting and results phases. The build is
+timed once without tracing for ops/sec, then repeated under tracemalloc
+for bytes per room; room_memory_stats() is printed alongside as a check of
+the runtime estimate.
+
+Changes to game_logic.py should not raise bytes/room: pass --budget to
+fail when it goes over a limit.
+
+    python benchmarks/bench_memory.py [rooms] [--budget BYTES_PER_ROOM]
+"""
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bot_or_not import store as store_module
+from bot_or_not.store import InMemoryGameStore, create_room, get_game, room_memory_stats, save_game
+
+PLAYERS = 6
+
+
+def build_rooms(rooms: int) -> int:
+    """Build rooms in the global store and return how many game calls were made"""
+    ops = 0
+    for n in range(rooms):
+        game = get_game(create_room())
+        for i in range(PLAYERS):
+            game.add_player(f"{game.room_id}-player-{i}", f"Player {i}")
+        ops += 1 + PLAYERS
+        if n % 4 == 0:
+            save_game(game)
+            continue
+        game.start_game()
+        ids = list(game.players)
+        for player_id in ids:
+            game.add_response(player_id, "Probably something involving a lot of snacks")
+        ops += 1 + len(ids)
+        if n % 4 == 1:
+            save_game(game)
+            continue
+        game.start_voting_phase()
+        for i, player_id in enumerate(ids):
+            game.add_vote(player_id, ids[(i + 1) % len(ids)], "kick" if i % 3 else "trust")
+        ops += 1 + len(ids)
+        if n % 4 == 3:
+            game.calculate_round_results()
+            ops += 1
+        save_game(game)
+    return ops
+
+
+def fresh_store():
+    store_module.store = InMemoryGameStore()
+    gc.collect()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rooms", type=int, nargs="?", default=100000)
+    parser.add_argument("--budget", type=int, help="fail if bytes/room exceeds this")
+    args = parser.parse_args()
+
+    fresh_store()
+    start = time.perf_counter()
+    ops = build_rooms(args.rooms)
+    elapsed = time.perf_counter() - start
+
+    fresh_store()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    build_rooms(args.rooms)
+    gc.collect()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_room = (after - before) / args.rooms
+
+    stats = room_memory_stats()
+    print(f"{args.rooms} rooms, {PLAYERS} players each")
+    print(f"build:    {elapsed:.2f}s, {args.rooms / elapsed:,.0f} rooms/s, {ops / elapsed:,.0f} ops/s")
+    print(f"traced:   {(after - before) / 1e6:.1f} MB ({per_room:,.0f} B/room, peak {peak / 1e6:.1f} MB)")
+    print(f"estimate: {stats['bytes'] / 1e6:.1f} MB ({stats['bytes'] / args.rooms:,.0f} B/room)")
+    for phase, phase_stats in stats["phases"].items():
+        print(f"  {phase:>9}: {phase_stats['rooms']:>7} rooms, {phase_stats['bytes'] / phase_stats['rooms']:>7,.0f} B/room")
+
+    if args.budget and per_room > args.budget:
+        print(f"FAIL: {per_room:,.0f} B/room is over the budget of {args.budget:,} B/room")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Benchmark writing and restoring a room snapshot.
+
+Builds rooms with six players each, spread over the lobby, response,
+voting and results phases, writes them with write_snapshot and restores
+them into a fresh InMemoryGameStore, the way startup does, after dropping
+the originals. Restored rooms
+stay encoded until first use, so thawing every room is timed separately.
+
+    python benchmarks/bench_snapshot.py [rooms]
+"""
+
+import gc
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bot_or_not.snapshot import read_snapshot, write_snapshot
+from bot_or_not.store import InMemoryGameStore
+
+
+def build_rooms(store: InMemoryGameStore, rooms: int):
+    for n in range(rooms):
+        game = store.create()
+        for i in range(6):
+            game.add_player(f"{game.room_id}-player-{i}", f"Player {i}")
+        if n % 4 == 0:
+            continue
+        game.start_game()
+        ids = list(game.players)
+        for player_id in ids:
+            game.add_response(player_id, "Probably something involving a lot of snacks")
+        if n % 4 == 1:
+            continue
+        game.start_voting_phase()
+        for i, player_id in enumerate(ids):
+            game.add_vote(player_id, ids[(i + 1) % len(ids)], "kick")
+        if n % 4 == 3:
+            game.calculate_round_results()
+
+
+def main():
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    store = InMemoryGameStore()
+    build_rooms(store, rooms)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "rooms.snapshot")
+
+        start = time.perf_counter()
+        written = write_snapshot(path, store.snapshot())
+        write_s = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        # Restore into a process that doesn't also hold the original rooms
+        room_ids = list(store.games)
+        del store
+        gc.collect()
+
+        restored = InMemoryGameStore()
+        start = time.perf_counter()
+        restored.restore(read_snapshot(path))
+        restore_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for room_id in room_ids:
+        restored.get(room_id)
+    thaw_s = time.perf_counter() - start
+
+    assert written == len(restored) == rooms
+    print(f"{rooms} rooms, {size / 1e6:.1f} MB ({size / rooms:.0f} B/room)")
+    print(f"write:   {write_s:.2f}s")
+    print(f"restore: {restore_s:.2f}s")
+    print(f"thaw:    {thaw_s:.2f}s ({thaw_s / rooms * 1e6:.0f} us/room on first use)")
+
+
+if __name__ == "__main__":
+    main()
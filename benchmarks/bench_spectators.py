@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Benchmark fanning room events out to many spectators.
+
+Attaches spectator connections to one room through ConnectionManager.watch,
+each with an in-memory socket whose send yields to the event loop like a
+real one, then publishes a series of room events and times each from the
+start of the broadcast until every spectator's socket has sent it. The
+time taken to queue the event on all spectators is reported separately;
+it is what a broadcast holds up its room for.
+
+    python benchmarks/bench_spectators.py [spectators] [--events N] [--max-latency-ms MS]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bot_or_not.main import encode_event, manager
+from bot_or_not.store import create_room, get_game
+
+
+class CountingSocket:
+    """Stands in for a WebSocket, counting the frames sent through it"""
+
+    scope = {}
+
+    def __init__(self, counter: "DeliveryCounter"):
+        self.counter = counter
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text: str):
+        await asyncio.sleep(0)
+        self.counter.sent()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class DeliveryCounter:
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.count = 0
+        self.done = asyncio.Event()
+
+    def reset(self):
+        self.count = 0
+        self.done.clear()
+
+    def sent(self):
+        self.count += 1
+        if self.count == self.expected:
+            self.done.set()
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(spectators: int, events: int):
+    room_id = create_room()
+    game = get_game(room_id)
+    game.add_player("player-1", "Player 1")
+    game.add_player("player-2", "Player 2")
+
+    counter = DeliveryCounter(spectators)
+    for _ in range(spectators):
+        await manager.watch(CountingSocket(counter), room_id)
+
+    queued, delivered = [], []
+    for n in range(events):
+        counter.reset()
+        game.set_presence("player-1", n % 2 == 1)
+        start = time.perf_counter()
+        await manager.broadcast_to_room(encode_event(game, "player_presence"), room_id)
+        queued.append(time.perf_counter() - start)
+        await counter.done.wait()
+        delivered.append(time.perf_counter() - start)
+
+    await manager.close_room(room_id)
+    return queued, delivered
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("spectators", type=int, nargs="?", default=5000)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--max-latency-ms", type=float, help="fail if p99 delivery latency exceeds this")
+    args = parser.parse_args()
+
+    queued, delivered = asyncio.run(run(args.spectators, args.events))
+    print(f"{args.spectators} spectators, {args.events} events")
+    for label, times in (("queued", queued), ("delivered", delivered)):
+        ms = [t * 1000 for t in times]
+        print(f"{label:>10}: p50 {statistics.median(ms):.2f} ms, p99 {percentile(ms, 0.99):.2f} ms, max {max(ms):.2f} ms")
+    print(f"throughput: {args.spectators * args.events / sum(delivered):,.0f} frames/s")
+
+    p99 = percentile(delivered, 0.99) * 1000
+    if args.max_latency_ms and p99 > args.max_latency_ms:
+        print(f"FAIL: p99 delivery latency {p99:.2f} ms is over {args.max_latency_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
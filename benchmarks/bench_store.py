@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Benchmark per-operation latency of the GameStore backends.
+
+Creates rooms, loads them, applies a vote-sized mutation and saves it, and
+batch-loads them, once against the in-memory store and once against the
+SQLite/WAL store in a temporary directory.
+
+    python benchmarks/bench_store.py [rooms]
+"""
+
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bot_or_not.store import InMemoryGameStore, SQLiteGameStore
+
+
+def timed(fn, *args):
+    start = time.perf_counter_ns()
+    result = fn(*args)
+    return result, time.perf_counter_ns() - start
+
+
+def report(backend: str, op: str, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples) / 1000
+    p99 = samples[int(len(samples) * 0.99) - 1] / 1000
+    print(f"{backend:>8} {op:>14} {p50:>10.1f} {p99:>10.1f}")
+
+
+def run(backend: str, store, rooms: int):
+    created, loads, saves, batches = [], [], [], []
+    room_ids = []
+
+    for _ in range(rooms):
+        game, ns = timed(store.create)
+        created.append(ns)
+        room_ids.append(game.room_id)
+        for i in range(6):
+            game.add_player(f"player-{i}", f"Player {i}")
+        game.start_game()
+        game.start_voting_phase()
+        store.save(game)
+
+    for room_id in room_ids:
+        game, ns = timed(store.get, room_id)
+        loads.append(ns)
+        # One vote per request, like /submit-vote
+        ids = list(game.players)
+        game.add_vote(ids[0], ids[1], "kick")
+        _, ns = timed(store.save, game)
+        saves.append(ns)
+
+    for i in range(0, len(room_ids), 50):
+        _, ns = timed(store.get_many, room_ids[i:i + 50])
+        batches.append(ns / len(room_ids[i:i + 50]))
+
+    report(backend, "create", created)
+    report(backend, "get", loads)
+    report(backend, "save", saves)
+    report(backend, "get_many/room", batches)
+
+
+def main():
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{rooms} rooms, latency in microseconds")
+    print(f"{'backend':>8} {'operation':>14} {'p50':>10} {'p99':>10}")
+    run("memory", InMemoryGameStore(), rooms)
+    with tempfile.TemporaryDirectory() as tmp:
+        run("sqlite", SQLiteGameStore(str(Path(tmp) / "rooms.db")), rooms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Benchmark the size of a voting phase's broadcasts in each wire format.
+
+Plays one room of six players into the voting phase and encodes what a
+player receives during it (voting_phase_started with the full state, then
+one vote_received patch per vote) with encode_event, as the server does.
+Each payload is then measured as sent in every format: JSON text, JSON with
+player handles (what the MessagePack wire does before packing), and
+MessagePack when msgpack is installed, each with and without
+permessage-deflate. Deflate keeps its window between messages, as browsers
+and the websockets server do by default.
+
+    python benchmarks/bench_wire.py
+"""
+
+import json
+import sys
+import uuid
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bot_or_not.game_logic import GameState
+from bot_or_not.main import encode_event
+from bot_or_not.wire import PlayerHandles, msgpack
+
+PLAYERS = 6
+
+
+def voting_phase_payloads():
+    """Player-audience payloads of a voting phase, in broadcast order"""
+    game = GameState("123456")
+    for i in range(PLAYERS):
+        game.add_player(str(uuid.uuid4()), f"Player {i}")
+    game.start_game()
+    ids = list(game.players)
+    for player_id in ids:
+        game.add_response(player_id, "Probably something involving a lot of snacks, and a nap")
+    game.take_patch()
+    game.start_voting_phase()
+    payloads = [encode_event(game, "voting_phase_started").payloads["player"]]
+    for i, player_id in enumerate(ids):
+        game.add_vote(player_id, ids[(i + 1) % len(ids)], "kick" if i % 3 else "trust")
+        payloads.append(encode_event(game, "vote_received").payloads["player"])
+    return payloads
+
+
+def deflated(frames):
+    """Frame sizes after permessage-deflate with context takeover"""
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    # Each message ends with an empty stored block, which is not sent
+    return [len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4 for frame in frames]
+
+
+def main():
+    payloads = voting_phase_payloads()
+    handles = PlayerHandles()
+    compact = [handles.compact(json.loads(payload)) for payload in payloads]
+    formats = {
+        "json": [payload.encode() for payload in payloads],
+        "json, handles": [json.dumps(message).encode() for message in compact],
+    }
+    if msgpack is not None:
+        formats["msgpack"] = [msgpack.packb(message) for message in compact]
+
+    print(f"voting phase of {PLAYERS} players and the AI: 1 full state, then {len(payloads) - 1} vote patches")
+    print(f"{'format':>24} {'state B':>8} {'patch B':>8} {'phase B':>8}")
+    for name, frames in formats.items():
+        for label, sizes in ((name, [len(frame) for frame in frames]), (name + ", deflate", deflated(frames))):
+            patch = sum(sizes[1:]) / len(sizes[1:])
+            print(f"{label:>24} {sizes[0]:>8} {patch:>8.0f} {sum(sizes):>8}")
+    if msgpack is None:
+        print("msgpack is not installed; install bot-or-not[msgpack] to include it")
+
+
+if __name__ == "__main__":
+    main()
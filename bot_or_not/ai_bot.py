@@ -2,9 +2,11 @@ import os
 import openai
 import random
 import asyncio
-from typing import List, Dict, Optional
+from typing import List, Optional
 from dotenv import load_dotenv
 
+from .game_logic import Player, Response
+
 # Load environment variables
 load_dotenv()
 
@@ -34,7 +36,7 @@ class AIBot:
                 print(f"Failed to initialize OpenAI client: {e}")
                 raise
     
-    async def generate_response(self, prompt: str, other_responses: List[Dict] = None) -> str:
+    async def generate_response(self, prompt: str, other_responses: List[Response] = None) -> str:
         """Generate a human-like response to the game prompt"""
         
         try:
@@ -48,7 +50,7 @@ class AIBot:
             if other_responses:
                 context = "\n\nHere are some other responses to this prompt for context:\n"
                 for i, response in enumerate(other_responses[:3]):  # Limit to 3 for context
-                    context += f"- {response.get('text', '')}\n"
+                    context += f"- {response.text}\n"
             
             system_prompt = f"""You are playing a social deduction game called "Bot or Not" where humans try to identify the AI player. 
             Your goal is to blend in with human players by giving creative, natural responses that sound human-written.
@@ -122,7 +124,7 @@ class AIBot:
         
         return random.choice(generic_fallbacks)
     
-    def should_vote_kick(self, target_response: str, all_responses: List[Dict]) -> bool:
+    def should_vote_kick(self, target_response: str, all_responses: List[Response]) -> bool:
         """Simple heuristic for AI to decide whether to vote kick someone"""
         
         # Basic strategies for AI voting:
@@ -148,10 +150,10 @@ class AIBot:
         # Vote to kick if response seems too AI-like
         return suspicion_score >= 2
     
-    def choose_vote_target(self, players: List[Dict], responses: List[Dict]) -> Optional[str]:
+    def choose_vote_target(self, players: List[Player], responses: List[Response]) -> Optional[str]:
         """Choose who to vote for based on responses"""
         
-        alive_players = [p for p in players if p["alive"] and not p["is_ai"]]
+        alive_players = [p for p in players if p.alive and not p.is_ai]
         if not alive_players:
             return None
         
@@ -159,12 +161,12 @@ class AIBot:
         player_scores = {}
         
         for response in responses:
-            player_id = response["player_id"]
+            player_id = response.player_id
             # Skip AI's own response
-            if any(p["id"] == player_id and p["is_ai"] for p in players):
+            if any(p.id == player_id and p.is_ai for p in players):
                 continue
             
-            text = response["text"]
+            text = response.text
             suspicion_score = 0
             
             # Check for AI-like patterns
@@ -183,7 +185,7 @@ class AIBot:
         
         # Sometimes vote randomly to appear human
         if random.random() < 0.4 or not player_scores:
-            return random.choice(alive_players)["id"]
+            return random.choice(alive_players).id
         
         # Vote for most suspicious player
         most_suspicious = max(player_scores.items(), key=lambda x: x[1])
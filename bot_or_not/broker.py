@@ -0,0 +1,239 @@
+"""Room-channel fanout so broadcasts reach sockets held by other workers."""
+
+import asyncio
+import fcntl
+import logging
+import marshal
+import os
+import struct
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class RoomMessage(NamedTuple):
+    """A room broadcast, encoded once per audience.
+
+    Each socket gets the payload of its player's audience: the one listed
+    in audiences, or the first payload for players not listed. A player may
+    also be listed with a payload of their own, keyed by their id. version is
+    the room version the message brings clients to, and base_version the
+    oldest version its patch applies to, None when it carries full state.
+    """
+    payloads: Dict[str, str]  # audience (or player_id) -> encoded message
+    audiences: Dict[str, str]  # player_id -> payload key, where not the first
+    version: int = 0
+    base_version: Optional[int] = None
+
+    def payload_for(self, player_id: str) -> str:
+        audience = self.audiences.get(player_id)
+        if audience is None:
+            return next(iter(self.payloads.values()))
+        return self.payloads[audience]
+
+
+# Called with (room_id, message, exclude_player) to deliver to this worker's sockets
+Deliver = Callable[[str, RoomMessage, Optional[str]], Awaitable[None]]
+
+
+class Broker:
+    """Publishes room messages to every worker subscribed to the room.
+
+    Each worker subscribes to the rooms it holds sockets for and delivers
+    only to those sockets; the message is encoded once by the publisher and
+    passed along as-is.
+    """
+
+    def attach(self, deliver: Deliver):
+        """Set where messages for this worker's sockets are delivered"""
+        self._deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def subscribe(self, room_id: str):
+        pass
+
+    def unsubscribe(self, room_id: str):
+        pass
+
+    async def publish(self, room_id: str, message: RoomMessage, exclude_player: Optional[str] = None):
+        raise NotImplementedError
+
+
+class InProcessBroker(Broker):
+    """Single-worker broker: publishing is local delivery"""
+
+    async def publish(self, room_id: str, message: RoomMessage, exclude_player: Optional[str] = None):
+        await self._deliver(room_id, message, exclude_player)
+
+
+# Frame: 4-byte body length, 1-byte kind, body
+_HEADER = struct.Struct("!IB")
+_SUBSCRIBE, _UNSUBSCRIBE, _PUBLISH = b"S"[0], b"U"[0], b"P"[0]
+
+
+def _frame(kind: int, body: bytes) -> bytes:
+    return _HEADER.pack(len(body), kind) + body
+
+
+async def _read_frame(reader: asyncio.StreamReader):
+    header = await reader.readexactly(_HEADER.size)
+    length, kind = _HEADER.unpack(header)
+    return kind, await reader.readexactly(length)
+
+
+class UnixSocketBroker(Broker):
+    """Broker for several workers on one host, relayed through a Unix socket hub.
+
+    Whichever worker takes the lock file hosts the hub; every worker,
+    including that one, connects to it as a client. The hub tracks room
+    subscriptions and forwards publish frames byte-for-byte to the other
+    subscribed workers. If the hub's worker exits, the others reconnect and
+    one of them takes over.
+    """
+
+    RECONNECT_DELAY = 0.5
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rooms: Set[str] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        # Hub state, only used by the worker holding the lock
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self._peers: Set[asyncio.StreamWriter] = set()
+
+    async def start(self):
+        reader = await self._connect()
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self._writer:
+            self._writer.close()
+        if self._server:
+            self._server.close()
+            for peer in self._peers:
+                peer.close()
+            os.close(self._lock_fd)
+
+    def subscribe(self, room_id: str):
+        self._rooms.add(room_id)
+        self._send(_frame(_SUBSCRIBE, room_id.encode()))
+
+    def unsubscribe(self, room_id: str):
+        self._rooms.discard(room_id)
+        self._send(_frame(_UNSUBSCRIBE, room_id.encode()))
+
+    async def publish(self, room_id: str, message: RoomMessage, exclude_player: Optional[str] = None):
+        # Workers run the same code, so the message is marshalled as-is
+        body = f"{room_id}\n{exclude_player or ''}\n".encode() + marshal.dumps(tuple(message))
+        self._send(_frame(_PUBLISH, body))
+        await self._deliver(room_id, message, exclude_player)
+
+    def _send(self, frame: bytes):
+        # Frames written while reconnecting are dropped; subscriptions are
+        # replayed on reconnect and clients resync missed versions
+        if self._writer and not self._writer.is_closing():
+            self._writer.write(frame)
+
+    # Client side
+
+    async def _connect(self) -> asyncio.StreamReader:
+        while True:
+            await self._try_host_hub()
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                continue
+            for room_id in self._rooms:
+                self._writer.write(_frame(_SUBSCRIBE, room_id.encode()))
+            return reader
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                kind, body = await _read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("Lost connection to room broker hub, reconnecting")
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                reader = await self._connect()
+                continue
+
+            if kind != _PUBLISH:
+                continue
+            room_id, exclude_player, message = body.split(b"\n", 2)
+            try:
+                await self._deliver(room_id.decode(), RoomMessage(*marshal.loads(message)), exclude_player.decode() or None)
+            except Exception as e:
+                logger.error(f"Error delivering brokered message to room {room_id.decode()}: {e}")
+
+    # Hub side
+
+    async def _try_host_hub(self):
+        """Start the hub if no other worker holds the lock"""
+        if self._server:
+            return
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return
+
+        # Holding the lock, any existing socket file is stale
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._lock_fd = fd
+        self._server = await asyncio.start_unix_server(self._serve_worker, path=self.path)
+        logger.info(f"Hosting room broker hub on {self.path}")
+
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        rooms: Set[bytes] = set()
+        self._peers.add(writer)
+        try:
+            while True:
+                kind, body = await _read_frame(reader)
+                if kind == _SUBSCRIBE:
+                    rooms.add(body)
+                    self._subscribers.setdefault(body, set()).add(writer)
+                elif kind == _UNSUBSCRIBE:
+                    rooms.discard(body)
+                    self._drop_subscriber(body, writer)
+                elif kind == _PUBLISH:
+                    room_id = body.split(b"\n", 1)[0]
+                    frame = _frame(_PUBLISH, body)
+                    for peer in self._subscribers.get(room_id, ()):
+                        if peer is not writer:
+                            peer.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            for room_id in rooms:
+                self._drop_subscriber(room_id, writer)
+            writer.close()
+
+    def _drop_subscriber(self, room_id: bytes, writer: asyncio.StreamWriter):
+        peers = self._subscribers.get(room_id)
+        if peers is not None:
+            peers.discard(writer)
+            if not peers:
+                del self._subscribers[room_id]
+
+
+def make_broker(spec: str) -> Broker:
+    """Build a broker from a ROOM_BROKER value: "local" or "unix:<path>" """
+    if spec == "local":
+        return InProcessBroker()
+    if spec.startswith("unix:"):
+        return UnixSocketBroker(spec[len("unix:"):])
+    raise ValueError(f"Unknown ROOM_BROKER backend: {spec}")
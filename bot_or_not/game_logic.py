@@ -1,138 +1,247 @@
+import json
 import random
+import secrets
+import sys
 import time
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+import uuid
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from datetime import datetime
+
+from .prompts import ALL_PROMPTS, PromptDeck, catalog
+
+VOTE_TYPES = ("kick", "trust")
+# Views of a room: alive players (and lobby members), eliminated players, and
+# everyone once the game is over
+AUDIENCES = ("player", "spectator", "reveal")
+PHASE_SECONDS = 60
+AI_NAMES = ("Alex", "Sam", "Jordan", "Casey", "Riley", "Morgan", "Taylor", "Jamie", "Cameron", "Avery",
+			"Charlie", "Skyler", "Quinn", "Drew", "Peyton", "Reese", "Sage", "Rowan", "Finley", "Emerson",
+			"Blake", "Hayden", "Kendall", "Tatum", "Aubrey", "Parker", "Sydney", "Dakota", "Cory", "Jessie",
+			"Alexis", "Taylor", "Jordan", "Casey", "Riley", "Morgan", "Jamie", "Cameron", "Avery")
+
+
+def _isoformat(timestamp: float) -> str:
+	"""Render a POSIX timestamp the way the frontend expects it"""
+	return datetime.fromtimestamp(timestamp).isoformat()
+
+
+@dataclass(slots=True)
+class Player:
+	"""A human or AI participant in a room; times are POSIX seconds"""
+	id: str
+	name: str
+	is_ai: bool = False
+	alive: bool = True
+	joined_at: float = field(default_factory=time.time)
+	anonymous_number: Optional[int] = None
+	display_name: Optional[str] = None
+	disconnected: bool = False
+	# Left through /leave-room, unlike a dropped connection; dropped on reset
+	left: bool = False
+	_joined_at_iso: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+	def to_dict(self, audience: str = "reveal") -> Dict:
+		"""Serialize to the JSON shape expected by the frontend.
+		
+		Outside the reveal audience the AI flag is left out and, once the game
+		has started, so are the real id, name and join time, which would give
+		away the player added at the start.
+		"""
+		if audience != "reveal":
+			if self.anonymous_number is None:
+				data = {"id": self.id, "name": self.name, "alive": self.alive}
+			else:
+				data = {"id": self.public_id, "name": self.display_name, "alive": self.alive}
+		else:
+			data = {
+				"id": self.id,
+				"name": self.name,
+				"is_ai": self.is_ai,
+				"alive": self.alive,
+				"joined_at": self._joined_at_iso or self._render_joined_at()
+			}
+		if self.anonymous_number is not None:
+			data["anonymous_number"] = self.anonymous_number
+			data["display_name"] = self.display_name
+		if self.disconnected:
+			data["disconnected"] = True
+		return data
+
+	@property
+	def public_id(self) -> str:
+		"""Id shown outside the reveal audience: the lobby id, then from the
+		start of the game one made from the shuffled player number, so it
+		can't be traced back to the lobby"""
+		if self.anonymous_number is None:
+			return self.id
+		return f"p{self.anonymous_number}"
+
+	def _render_joined_at(self) -> str:
+		self._joined_at_iso = _isoformat(self.joined_at)
+		return self._joined_at_iso
+
+
+@dataclass(slots=True)
+class Response:
+	"""A player's answer to the current prompt"""
+	player_id: str
+	text: str
+	timestamp: float = field(default_factory=time.time)
+	_timestamp_iso: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+	def to_dict(self, ids: Optional[Dict[str, str]] = None) -> Dict:
+		"""ids maps player ids to the ones shown, when they differ"""
+		if self._timestamp_iso is None:
+			self._timestamp_iso = _isoformat(self.timestamp)
+		return {
+			"player_id": ids[self.player_id] if ids else self.player_id,
+			"text": self.text,
+			"timestamp": self._timestamp_iso
+		}
+
+
+@dataclass(slots=True)
+class Vote:
+	"""A kick or trust vote cast during the voting phase"""
+	voter_id: str
+	target_id: str
+	type: str  # "kick" or "trust"
+	timestamp: float = field(default_factory=time.time)
+	_timestamp_iso: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+	def to_dict(self, ids: Optional[Dict[str, str]] = None) -> Dict:
+		"""ids maps player ids to the ones shown, when they differ"""
+		if self._timestamp_iso is None:
+			self._timestamp_iso = _isoformat(self.timestamp)
+		return {
+			"voter_id": ids[self.voter_id] if ids else self.voter_id,
+			"target_id": ids[self.target_id] if ids else self.target_id,
+			"type": self.type,
+			"timestamp": self._timestamp_iso
+		}
+
 
 class GameState:
 	"""Manages the state and logic for a Bot or Not game room"""
 	
+	# Constants live on the class: past about 30 instance attributes
+	# CPython stops sharing dict keys between rooms, doubling the __dict__
+	max_players = 8
+	min_players = 2
+	
 	def __init__(self, room_id: str):
 		self.room_id = room_id
-		self.players: List[Dict] = []
+		# Indexed by id; dicts keep insertion order, which is the display order
+		self.players: Dict[str, Player] = {}
 		self.current_round = 0
 		self.phase = "waiting"  # waiting, response, voting, results, game_over
 		self.prompt = ""
-		self.responses: List[Dict] = []
-		self.votes: List[Dict] = []
+		self.responses: Dict[str, Response] = {}  # player_id -> response
+		self.votes: Dict[str, Vote] = {}  # voter_id -> vote
 		self.ai_player_id: Optional[str] = None
-		self.timer_end: Optional[datetime] = None
-		self.max_players = 8
-		self.min_players = 2
-		self.created_at = datetime.now()
-		
-		# Game prompts
-		self.prompts = [
-			"You're a ghost haunting your old workplace. What do you do first?",
-			"You can only communicate through interpretive dance for a day. How do you order coffee?",
-			"You're stuck in an elevator with your worst enemy. What's your opening line?",
-			"You discover you can talk to animals, but they're all very gossipy. What do you learn first?",
-			"You wake up with the ability to read minds, but only your own thoughts from 10 years ago. What's the first thing you 'hear'?",
-			"You're the last person on Earth and find a working phone booth. Who do you call?",
-			"You can swap lives with anyone for 24 hours. How do you convince them it's worth it?",
-			"You're a time traveler but can only go back 37 minutes. How do you use this power?",
-			"You find a magic mirror that shows you your future self. What do you hope to see?",
-			"You can only eat one food for the rest of your life, but it has to be something you hate. What do you choose?",
-			"You have to survive a zombie apocalypse, but the zombies are all your exes. What's your survival strategy?",
-			"You can only communicate through memes for a week. How do you explain your job to someone?",
-			"You wake up one day and realize you're the main character in a sitcom. What's the first scene?",
-			"You can only speak in rhymes for a day. How do you order food at a restaurant?",
-			"You find a genie who can only grant you wishes that make your life more inconvenient. What do you wish for?",
-			"You can only wear one outfit for the rest of your life, but it has to be something you hate. What do you choose?",
-			"You can only listen to one song for the rest of your life, but it has to be a song you hate. What do you choose?",
-			"You can only watch one movie for the rest of your life, but it has to be a movie you hate. What do you choose?",
-			"You can only read one book for the rest of your life, but it has to be a book you hate. What do you choose?"
-		]
-	
+		# Phase deadline as POSIX seconds, as stored and shown to clients, and
+		# on the monotonic clock, which checks use so wall-clock jumps can't
+		# shorten or extend a phase
+		self.timer_end: Optional[float] = None
+		self.deadline: Optional[float] = None
+		self._timer_end_iso: Optional[str] = None
+		self.created_at = time.time()
+		self.last_activity = time.monotonic()
+		self._alive_count = 0
+		# Running vote tallies for the current round: target_id -> votes
+		self._kick_counts: Dict[str, int] = {}
+		self._trust_counts: Dict[str, int] = {}
+		
+		# Bumped on every mutation; snapshots are cached per version
+		self.version = 0
+		self.stored_version = 0  # Version last loaded from / saved to the store
+		self._views_version = -1
+		self._views: Dict[str, Dict] = {}  # audience -> state dict
+		self._views_json: Dict[str, str] = {}  # audience -> encoded state dict
+		
+		# Changes since the last take_patch(), for delta broadcasts
+		self._patch_base = 0
+		self._patch_players: Set[str] = set()
+		self._patch_full = False
+		
+		# Event log of the current game, applied on top of log_base (the state
+		# it started from, as a _state_row(); None for a new room)
+		self.log: List[tuple] = []
+		self.log_base: Optional[tuple] = None
+		self._pending_events: List[tuple] = []  # Not yet taken by the store
+		
+		# Shuffled walk over the shared prompt catalog, set when a game starts
+		self.prompt_deck: Optional[PromptDeck] = None
+
 	def add_player(self, player_id: str, name: str) -> bool:
 		"""Add a player to the game if there's room"""
 		if len(self.players) >= self.max_players:
 			return False
 		
-		if any(p["id"] == player_id for p in self.players):
+		if player_id in self.players:
 			return False
 		
-		player = {
-			"id": player_id,
-			"name": name,
-			"is_ai": False,
-			"alive": True,
-			"joined_at": datetime.now()
-		}
-		
-		self.players.append(player)
+		self._record(("join", player_id, name, time.time()))
+		self.mark_active()
 		return True
 	
-	def add_ai_player(self) -> str:
-		"""Add AI player to the game"""
-		ai_names = ["Alex", "Sam", "Jordan", "Casey", "Riley", "Morgan", "Taylor", "Jamie", "Cameron", "Avery",
-					"Charlie", "Skyler", "Quinn", "Drew", "Peyton", "Reese", "Sage", "Rowan", "Finley", "Emerson",
-					"Blake", "Hayden", "Kendall", "Tatum", "Aubrey", "Parker", "Sydney", "Dakota", "Cory", "Jessie",
-					"Alexis", "Taylor", "Jordan", "Casey", "Riley", "Morgan", "Jamie", "Cameron", "Avery"]
-		ai_name = random.choice(ai_names)
-		ai_id = f"ai_{random.randint(1000, 9999)}"
-		
-		ai_player = {
-			"id": ai_id,
-			"name": ai_name,
-			"is_ai": True,
-			"alive": True,
-			"joined_at": datetime.now()
-		}
-		
-		self.players.append(ai_player)
-		self.ai_player_id = ai_id
-		return ai_id
+	def _pick_ai_player(self) -> Tuple[str, str]:
+		"""Choose an ID and name for the AI player"""
+		ai_name = random.choice(AI_NAMES)
+		# Formatted like the players' ids, so the id doesn't give the AI away
+		ai_id = str(uuid.uuid4())
+		return ai_id, ai_name
+	
+	def _phase_deadline(self) -> float:
+		return time.time() + PHASE_SECONDS
+	
+	def _set_timer(self, timer_end: Optional[float]):
+		self.timer_end = timer_end
+		if timer_end is None:
+			self.deadline = self._timer_end_iso = None
+		else:
+			self.deadline = time.monotonic() + (timer_end - time.time())
+			self._timer_end_iso = _isoformat(timer_end)
+	
+	def timer_expired(self) -> bool:
+		"""Whether the current phase's deadline has passed"""
+		return self.deadline is not None and time.monotonic() > self.deadline
 	
 	def can_start_game(self) -> bool:
 		"""Check if game can start (enough players)"""
 		return len(self.players) >= self.min_players
 	
-	def start_game(self) -> bool:
+	def start_game(self, prompt_category: str = ALL_PROMPTS) -> bool:
 		"""Start the game by adding AI and beginning first round"""
-		if not self.can_start_game():
+		if self.phase != "waiting" or not self.can_start_game():
+			return False
+		
+		if prompt_category not in catalog:
 			return False
 		
 		# Add AI player if not already added
+		ai_id = ai_name = None
+		order = list(self.players)
 		if not self.ai_player_id:
-			self.add_ai_player()
-		
-		# Assign anonymous player numbers and randomize order
-		self.assign_anonymous_numbers()
-		
-		self.phase = "response"
-		self.current_round = 1
-		self.start_response_phase()
+			ai_id, ai_name = self._pick_ai_player()
+			order.append(ai_id)
+		
+		# Randomize positions so the AI can't be spotted by join order
+		random.shuffle(order)
+		prompt, deck = catalog.draw(catalog.new_deck(prompt_category))
+		self._record(("start", time.time(), ai_id, ai_name, order, prompt, self._phase_deadline(), tuple(deck)))
+		self.mark_active()
 		return True
 	
-	def assign_anonymous_numbers(self):
-		"""Assign anonymous player numbers (Player 1, Player 2, etc.) and randomize positions"""
-		# Shuffle players to randomize AI position
-		shuffled_players = self.players.copy()
-		random.shuffle(shuffled_players)
-		
-		# Assign anonymous numbers
-		for i, player in enumerate(shuffled_players):
-			player["anonymous_number"] = i + 1
-			player["display_name"] = f"Player {i + 1}"
-		
-		# Update the players list with new order
-		self.players = shuffled_players
-
-	def start_response_phase(self):
-		"""Start a new response phase with a random prompt"""
-		self.phase = "response"
-		self.prompt = random.choice(self.prompts)
-		self.responses = []
-		self.votes = []
-		self.timer_end = datetime.now() + timedelta(seconds=60)
-	
 	def add_response(self, player_id: str, text: str) -> bool:
 		"""Add a player's response to the current prompt"""
 		if self.phase != "response":
 			return False
 		
 		player = self.get_player(player_id)
-		if not player or not player["alive"]:
+		if not player or not player.alive:
 			return False
 		
 		# Validate response length
@@ -140,38 +249,29 @@ class GameState:
 		if len(text) < 10 or len(text) > 180:
 			return False
 		
-		# Remove existing response from this player
-		self.responses = [r for r in self.responses if r["player_id"] != player_id]
-		
-		response = {
-			"player_id": player_id,
-			"text": text,
-			"timestamp": datetime.now()
-		}
-		
-		self.responses.append(response)
+		self._record(("respond", player_id, text, time.time()))
+		if not player.is_ai:
+			self.mark_active()
 		return True
 	
 	def can_advance_to_voting(self) -> bool:
 		"""Check if all alive players have submitted responses or timer expired"""
-		alive_players = [p for p in self.players if p["alive"]]
-		
 		# Check if timer has expired
-		if self.timer_end and datetime.now() > self.timer_end:
+		if self.timer_expired():
 			return True
 			
 		# Check if all players have responded
-		return len(self.responses) >= len(alive_players)
+		return len(self.responses) >= self._alive_count
 	
 	def start_voting_phase(self):
 		"""Start the voting phase"""
 		if self.phase != "response":
 			return False
 		
-		self.phase = "voting"
-		self.timer_end = datetime.now() + timedelta(seconds=60)
 		# Shuffle responses to anonymize them initially
-		random.shuffle(self.responses)
+		order = list(self.responses)
+		random.shuffle(order)
+		self._record(("voting", order, self._phase_deadline()))
 		return True
 	
 	def add_vote(self, voter_id: str, target_id: str, vote_type: str) -> bool:
@@ -182,122 +282,96 @@ class GameState:
 		voter = self.get_player(voter_id)
 		target = self.get_player(target_id)
 		
-		if not voter or not target or not voter["alive"] or not target["alive"]:
+		if not voter or not target or not voter.alive or not target.alive:
 			return False
 		
 		if voter_id == target_id:
 			return False
 		
-		# Remove existing vote from this voter
-		self.votes = [v for v in self.votes if v["voter_id"] != voter_id]
-		
-		vote = {
-			"voter_id": voter_id,
-			"target_id": target_id,
-			"type": vote_type,  # "kick" or "trust"
-			"timestamp": datetime.now()
-		}
+		if vote_type not in VOTE_TYPES:
+			return False
 		
-		self.votes.append(vote)
+		self._record(("vote", voter_id, target_id, vote_type, time.time()))
+		if not voter.is_ai:
+			self.mark_active()
 		return True
 	
 	def can_advance_to_results(self) -> bool:
 		"""Check if all alive players have voted or timer expired"""
-		alive_players = [p for p in self.players if p["alive"]]
-		
 		# Check if timer has expired
-		if self.timer_end and datetime.now() > self.timer_end:
+		if self.timer_expired():
 			return True
 			
 		# Check if all players have voted
-		return len(self.votes) >= len(alive_players)
+		return len(self.votes) >= self._alive_count
+	
+	def get_vote_tally(self) -> Dict[str, Dict[str, int]]:
+		"""Kick and trust votes received so far this round, per target"""
+		return {"kick": dict(self._kick_counts), "trust": dict(self._trust_counts)}
 	
 	def calculate_round_results(self) -> Dict:
-		"""Calculate voting results and eliminate player if needed"""
+		"""Calculate voting results and eliminate player if needed.
+		
+		Each trust vote a player receives cancels one kick vote against them;
+		the player with the most kicks left is eliminated (ties at random), so
+		a player trusted at least as much as they are kicked is protected.
+		O(alive players) thanks to the running tallies.
+		"""
 		if self.phase != "voting":
 			return {}
 		
-		# Count kick votes for each player
 		kick_counts = {}
-		alive_players = [p for p in self.players if p["alive"]]
-		
-		for player in alive_players:
-			kick_counts[player["id"]] = 0
-		
-		for vote in self.votes:
-			if vote["type"] == "kick" and vote["target_id"] in kick_counts:
-				kick_counts[vote["target_id"]] += 1
-		
-		# Find player with most kick votes
-		eliminated_player_id = None
-		max_kicks = 0
+		trust_counts = {}
+		max_net = 0
 		tied_players = []
-		
-		for player_id, kick_count in kick_counts.items():
-			if kick_count > max_kicks:
-				max_kicks = kick_count
-				eliminated_player_id = player_id
-				tied_players = [player_id]
-			elif kick_count == max_kicks and kick_count > 0:
-				tied_players.append(player_id)
-		
-		# Handle ties by random elimination
-		if len(tied_players) > 1 and max_kicks > 0:
-			eliminated_player_id = random.choice(tied_players)
-		
-		# Eliminate player if they received at least one vote
+		for player in self.players.values():
+			if not player.alive:
+				continue
+			kicks = kick_counts[player.id] = self._kick_counts.get(player.id, 0)
+			trusts = trust_counts[player.id] = self._trust_counts.get(player.id, 0)
+			net = kicks - trusts
+			if net > max_net:
+				max_net = net
+				tied_players = [player.id]
+			elif net == max_net and net > 0:
+				tied_players.append(player.id)
+		
+		# Eliminate player if they have kicks left after trust; ties are random
+		eliminated_player_id = random.choice(tied_players) if tied_players else None
+		self._record(("results", eliminated_player_id))
+		
+		# Results go to the players, so they name them by their in-game ids;
+		# only the eliminated player's identity is revealed
+		ids = self.public_ids("player")
 		eliminated_player = None
-		if eliminated_player_id and max_kicks > 0:
-			eliminated_player = self.get_player(eliminated_player_id)
-			if eliminated_player:
-				eliminated_player["alive"] = False
-				# Create a clean serializable copy of the eliminated player
-				eliminated_player_copy = {
-					"id": eliminated_player["id"],
-					"name": eliminated_player["name"],
-					"is_ai": eliminated_player["is_ai"],
-					"alive": eliminated_player["alive"]
-				}
-				# Add other fields that might exist, ensuring datetime conversion
-				if "joined_at" in eliminated_player:
-					if hasattr(eliminated_player["joined_at"], 'isoformat'):
-						eliminated_player_copy["joined_at"] = eliminated_player["joined_at"].isoformat()
-					else:
-						eliminated_player_copy["joined_at"] = eliminated_player["joined_at"]
-				
-				if "anonymous_number" in eliminated_player:
-					eliminated_player_copy["anonymous_number"] = eliminated_player["anonymous_number"]
-				
-				if "display_name" in eliminated_player:
-					eliminated_player_copy["display_name"] = eliminated_player["display_name"]
-				
-				eliminated_player = eliminated_player_copy
-		
-		self.phase = "results"
+		if eliminated_player_id:
+			eliminated = self.players[eliminated_player_id]
+			eliminated_player = eliminated.to_dict()
+			eliminated_player["id"] = eliminated.public_id
 		
 		return {
 			"eliminated_player": eliminated_player,
-			"vote_counts": kick_counts,
+			"vote_counts": {ids[player_id]: count for player_id, count in kick_counts.items()},
+			"trust_counts": {ids[player_id]: count for player_id, count in trust_counts.items()},
 			"total_votes": len(self.votes),
-			"was_tie": len(tied_players) > 1 and max_kicks > 0
+			"was_tie": len(tied_players) > 1
 		}
 	
 	def check_win_condition(self) -> Optional[str]:
 		"""Check if game has ended and return winner"""
-		alive_players = [p for p in self.players if p["alive"]]
-		alive_humans = [p for p in alive_players if not p["is_ai"]]
 		ai_player = self.get_player(self.ai_player_id) if self.ai_player_id else None
+		ai_alive = ai_player is not None and ai_player.alive
 		
 		# AI wins if it's in final 2
-		if len(alive_players) <= 2 and ai_player and ai_player["alive"]:
+		if self._alive_count <= 2 and ai_alive:
 			return "ai"
 		
 		# Humans win if AI is eliminated
-		if ai_player and not ai_player["alive"]:
+		if ai_player and not ai_player.alive:
 			return "humans"
 		
 		# Humans win if only humans remain
-		if len(alive_humans) == len(alive_players) and len(alive_players) > 0:
+		if not ai_alive and self._alive_count > 0:
 			return "humans"
 		
 		return None
@@ -306,134 +380,547 @@ class GameState:
 		"""Advance to next round if game hasn't ended"""
 		winner = self.check_win_condition()
 		if winner:
-			self.phase = "game_over"
+			self._record(("game_over",))
 			return False
 		
-		self.current_round += 1
-		self.start_response_phase()
+		prompt, deck = catalog.draw(self.prompt_deck)
+		self._record(("round", prompt, self._phase_deadline(), tuple(deck)))
 		return True
 	
-	def get_player(self, player_id: str) -> Optional[Dict]:
-		"""Get player by ID"""
-		for player in self.players:
-			if player["id"] == player_id:
-				return player
-		return None
+	def remove_player(self, player_id: str) -> bool:
+		"""Remove a player from the game (only marked as left once it started)"""
+		if player_id not in self.players:
+			return False
+		self._record(("leave", player_id))
+		self.mark_active()
+		return True
 	
-	def get_alive_players(self) -> List[Dict]:
-		"""Get all alive players"""
-		return [p for p in self.players if p["alive"]]
+	def set_presence(self, player_id: str, connected: bool) -> bool:
+		"""Record whether a player has a live connection; False if nothing changed"""
+		player = self.players.get(player_id)
+		if player is None or player.left or player.disconnected == (not connected):
+			return False
+		self._record(("presence", player_id, connected))
+		return True
 	
-	def get_game_state_dict(self) -> Dict:
-		"""Get game state as dictionary for API responses"""
-		winner = self.check_win_condition()
-		
-		# Convert datetime objects to ISO strings for JSON serialization
-		responses_serializable = []
-		for response in self.responses:
-			response_copy = response.copy()
-			if 'timestamp' in response_copy:
-				response_copy['timestamp'] = response_copy['timestamp'].isoformat()
-			responses_serializable.append(response_copy)
-		
-		votes_serializable = []
-		for vote in self.votes:
-			vote_copy = vote.copy()
-			if 'timestamp' in vote_copy:
-				vote_copy['timestamp'] = vote_copy['timestamp'].isoformat()
-			votes_serializable.append(vote_copy)
-		
-		players_serializable = []
-		for player in self.players:
-			player_copy = player.copy()
-			if 'joined_at' in player_copy:
-				player_copy['joined_at'] = player_copy['joined_at'].isoformat()
-			players_serializable.append(player_copy)
+	def reset_to_lobby(self) -> bool:
+		"""Reset game state back to lobby"""
+		if self.phase == "waiting":
+			return True  # Already in lobby
 		
-		return {
-			"room_id": self.room_id,
-			"players": players_serializable,
-			"current_round": self.current_round,
-			"phase": self.phase,
-			"prompt": self.prompt,
-			"responses": responses_serializable if self.phase in ["voting", "results"] else [],
-			"votes": votes_serializable if self.phase == "results" else [],
-			"ai_player_id": self.ai_player_id,
-			"timer_end": self.timer_end.isoformat() if self.timer_end else None,
-			"winner": winner,
-			"can_start": self.can_start_game(),
-			"alive_players": len(self.get_alive_players())
-		}
-
-	def remove_player(self, player_id: str) -> bool:
-		"""Remove a player from the game"""
+		self._record(("reset",))
+		self.mark_active()
+		return True
+	
+	# Event log
+	#
+	# Every transition is recorded as an event, a tuple of its kind and
+	# arguments, and applied by the matching _on_<kind> method. Events carry
+	# every random or clock-dependent outcome (times as POSIX seconds), so
+	# applying the same events to the same state always gives the same
+	# result. Each event bumps the version by exactly one.
+	#
+	#   ("join", player_id, name, joined_at)
+	#   ("leave", player_id)
+	#   ("presence", player_id, connected)
+	#   ("start", started_at, ai_player_id, ai_name, player_order, prompt, timer_end, deck)
+	#       ai_player_id and ai_name are None when the AI was already present;
+	#       deck is the PromptDeck after drawing prompt, as a tuple (absent in
+	#       events from before prompt decks, which replay without one)
+	#   ("respond", player_id, text, timestamp)
+	#   ("voting", response_order, timer_end)
+	#   ("vote", voter_id, target_id, vote_type, timestamp)
+	#   ("results", eliminated_player_id or None)
+	#   ("round", prompt, timer_end, deck)
+	#   ("game_over",)
+	#   ("reset",)
+	
+	def _record(self, event: tuple):
+		"""Apply a new transition and queue it for the store"""
+		self.apply_event(event)
+		self._pending_events.append(event)
+	
+	def apply_event(self, event: tuple):
+		"""Apply an event, e.g. one replayed from a store or journal"""
+		getattr(self, "_on_" + event[0])(*event[1:])
+		self.log.append(event)
+	
+	def take_events(self) -> List[tuple]:
+		"""Return the events recorded since the previous call, oldest first.
+		
+		The last one produced the current version, so event i of n produced
+		version - n + i + 1.
+		"""
+		events, self._pending_events = self._pending_events, []
+		return events
+	
+	def replay(self, steps: Optional[int] = None) -> "GameState":
+		"""Rebuild the room as it was after the first `steps` events of the
+		current game (all of them by default), without touching this one"""
+		if self.log_base is None:
+			game = GameState(self.room_id)
+			game.created_at = self.created_at
+		else:
+			game = GameState._from_state_row(self.log_base)
+		for event in self.log[:steps]:
+			game.apply_event(event)
+		return game
+	
+	def _on_join(self, player_id: str, name: str, joined_at: float):
+		self.players[player_id] = Player(id=player_id, name=name, joined_at=joined_at)
+		self._alive_count += 1
+		self._touch(player_id=player_id)
+	
+	def _on_leave(self, player_id: str):
 		if self.phase != "waiting":
-			# During active game, just mark as disconnected
-			player = self.get_player(player_id)
-			if player:
-				player["disconnected"] = True
-				return True
-			return False
+			# During active game, just mark as left; they are dropped on reset
+			player = self.players[player_id]
+			player.left = player.disconnected = True
+			self._touch(player_id=player_id)
+			return
 		
 		# In lobby, completely remove the player
-		initial_count = len(self.players)
-		self.players = [p for p in self.players if p["id"] != player_id]
+		player = self.players.pop(player_id)
+		if player.alive:
+			self._alive_count -= 1
 		
 		# If AI player left, clear AI player ID
 		if player_id == self.ai_player_id:
 			self.ai_player_id = None
-		
-		return len(self.players) < initial_count
+			self._touch(full=True)
+		else:
+			self._touch(player_id=player_id)
 	
-	def reset_to_lobby(self) -> bool:
-		"""Reset game state back to lobby"""
-		if self.phase == "waiting":
-			return True  # Already in lobby
+	def _on_presence(self, player_id: str, connected: bool):
+		self.players[player_id].disconnected = not connected
+		self._touch(player_id=player_id)
+	
+	def _on_start(self, started_at: float, ai_id: Optional[str], ai_name: Optional[str], order: List[str],
+				prompt: str, timer_end: float, deck: Optional[tuple] = None):
+		# A game's log starts from the lobby it was started from
+		self.log_base = self._state_row()
+		self.log = []
+		
+		if ai_id:
+			self.players[ai_id] = Player(id=ai_id, name=ai_name, is_ai=True, joined_at=started_at)
+			self._alive_count += 1
+			self.ai_player_id = ai_id
+		
+		# Assign anonymous player numbers (Player 1, Player 2, etc.) in the shuffled order
+		players = self.players
+		self.players = {}
+		for i, player_id in enumerate(order):
+			player = players[player_id]
+			player.anonymous_number = i + 1
+			player.display_name = f"Player {i + 1}"
+			self.players[player_id] = player
 		
+		self.current_round = 1
+		self._begin_round(prompt, timer_end, deck)
+	
+	def _on_round(self, prompt: str, timer_end: float, deck: Optional[tuple] = None):
+		self.current_round += 1
+		self._begin_round(prompt, timer_end, deck)
+	
+	def _begin_round(self, prompt: str, timer_end: float, deck: Optional[tuple]):
+		self.phase = "response"
+		self.prompt = prompt
+		self.prompt_deck = PromptDeck(*deck) if deck else None
+		self.responses = {}
+		self.votes = {}
+		self._kick_counts = {}
+		self._trust_counts = {}
+		self._set_timer(timer_end)
+		self._touch(full=True)
+	
+	def _on_respond(self, player_id: str, text: str, timestamp: float):
+		# Replace existing response from this player (moves it to the end)
+		self.responses.pop(player_id, None)
+		self.responses[player_id] = Response(player_id=player_id, text=text, timestamp=timestamp)
+		self._touch()
+	
+	def _on_voting(self, order: List[str], timer_end: float):
+		self.phase = "voting"
+		self._set_timer(timer_end)
+		self.responses = {player_id: self.responses[player_id] for player_id in order}
+		self._touch(full=True)
+	
+	def _on_vote(self, voter_id: str, target_id: str, vote_type: str, timestamp: float):
+		# Replace existing vote from this voter, taking it off the tally
+		previous = self.votes.pop(voter_id, None)
+		if previous:
+			self._count_vote(previous.target_id, previous.type, -1)
+		self.votes[voter_id] = Vote(voter_id=voter_id, target_id=target_id, type=vote_type, timestamp=timestamp)
+		self._count_vote(target_id, vote_type, 1)
+		self._touch()
+	
+	def _count_vote(self, target_id: str, vote_type: str, delta: int):
+		counts = self._kick_counts if vote_type == "kick" else self._trust_counts
+		count = counts.get(target_id, 0) + delta
+		if count:
+			counts[target_id] = count
+		else:
+			del counts[target_id]
+	
+	def _on_results(self, eliminated_player_id: Optional[str]):
+		if eliminated_player_id:
+			player = self.players[eliminated_player_id]
+			player.alive = False
+			self._alive_count -= 1
+		self.phase = "results"
+		self._touch(full=True)
+	
+	def _on_game_over(self):
+		self.phase = "game_over"
+		self._touch(full=True)
+	
+	def _on_reset(self):
 		# Reset all players to alive and remove AI
-		human_players = [p for p in self.players if not p["is_ai"] and not p.get("disconnected", False)]
+		human_players = [p for p in self.players.values() if not p.is_ai and not p.left]
 		for player in human_players:
-			player["alive"] = True
-			if "anonymous_number" in player:
-				del player["anonymous_number"]
-			if "display_name" in player:
-				del player["display_name"]
+			player.alive = True
+			player.anonymous_number = None
+			player.display_name = None
 		
-		self.players = human_players
+		self.players = {p.id: p for p in human_players}
+		self._alive_count = len(human_players)
 		self.current_round = 0
 		self.phase = "waiting"
 		self.prompt = ""
-		self.responses = []
-		self.votes = []
+		self.responses = {}
+		self.votes = {}
+		self._kick_counts = {}
+		self._trust_counts = {}
 		self.ai_player_id = None
-		self.timer_end = None
+		self._set_timer(None)
+		self._touch(full=True)
+	
+	def get_player(self, player_id: str) -> Optional[Player]:
+		"""Get player by ID"""
+		return self.players.get(player_id)
+	
+	def get_alive_players(self) -> List[Player]:
+		"""Get all alive players"""
+		return [p for p in self.players.values() if p.alive]
+	
+	def _touch(self, player_id: Optional[str] = None, full: bool = False):
+		"""Record a mutation so cached snapshots are rebuilt on next read.
+		
+		player_id marks a single player record as changed; full marks a change
+		(phase, prompt, ordering...) that a patch cannot express.
+		"""
+		self.version += 1
+		if full:
+			self._patch_full = True
+		elif player_id:
+			self._patch_players.add(player_id)
+	
+	def mark_active(self):
+		"""Refresh the idle timer; only player-driven changes count as activity"""
+		self.last_activity = time.monotonic()
+	
+	def audience_of(self, player_id: Optional[str]) -> str:
+		"""Which view of the room a player, or a reader who isn't one, gets"""
+		if self.phase == "game_over":
+			return "reveal"
+		player = self.players.get(player_id) if player_id else None
+		if player is not None and not player.alive:
+			return "spectator"
+		return "player"
+	
+	def public_ids(self, audience: str) -> Optional[Dict[str, str]]:
+		"""Player ids mapped to the ones an audience is shown, None when they
+		are the same"""
+		if audience == "reveal" or self.phase == "waiting":
+			return None
+		return {player.id: player.public_id for player in self.players.values()}
+	
+	def player_id_for(self, public_id: str) -> Optional[str]:
+		"""Id of the player shown to the others as public_id"""
+		for player in self.players.values():
+			if player.public_id == public_id:
+				return player.id
+		return None
+	
+	def audiences(self) -> List[str]:
+		"""The audiences the room's players are currently in, default first"""
+		if self.phase == "game_over":
+			return ["reveal"]
+		if self._alive_count < len(self.players):
+			return ["player", "spectator"]
+		return ["player"]
+	
+	def take_patch(self, audiences: Iterable[str] = ("player",)) -> Optional[Dict[str, Dict]]:
+		"""Return the changes since the previous call as one patch per
+		audience, or None if a full snapshot is needed, and start tracking a
+		new patch.
+		
+		Patches carry whole player records and the summary fields, so they can
+		be applied by any client whose version is at least base_version.
+		"""
+		patches = None
+		if not self._patch_full:
+			players = []
+			removed_players = []
+			for player_id in self._patch_players:
+				player = self.players.get(player_id)
+				if player:
+					players.append(player)
+				else:
+					removed_players.append(player_id)
+			patches = {}
+			for audience in audiences:
+				patches[audience] = {
+					"base_version": self._patch_base,
+					"version": self.version,
+					"state": self._summary_fields(audience),
+					"players": [player.to_dict(audience) for player in players],
+					"removed_players": removed_players
+				}
 		
-		return True
+		self._patch_base = self.version
+		self._patch_players = set()
+		self._patch_full = False
+		return patches
+	
+	def _summary_fields(self, audience: str) -> Dict:
+		"""Cheap derived fields included in every snapshot and patch"""
+		fields = {
+			"winner": self.check_win_condition(),
+			"can_start": self.can_start_game(),
+			"alive_players": self._alive_count,
+			"response_count": len(self.responses),
+			"vote_count": len(self.votes)
+		}
+		# Eliminated players can follow the vote as it happens
+		if audience == "spectator" and self.phase == "voting":
+			ids = self.public_ids(audience)
+			fields["vote_tally"] = {
+				vote_type: {ids[player_id]: count for player_id, count in counts.items()}
+				for vote_type, counts in self.get_vote_tally().items()
+			}
+		return fields
+	
+	def get_game_state_dict(self, audience: str = "player") -> Dict:
+		"""Get game state as dictionary for API responses, as seen by an audience.
+		
+		The dict is cached until the next mutation and shared between callers,
+		so it must be treated as read-only.
+		"""
+		if self._views_version != self.version:
+			self._views = {}
+			self._views_json = {}
+			self._views_version = self.version
+		view = self._views.get(audience)
+		if view is None:
+			view = self._views[audience] = self._build_game_state_dict(audience)
+		return view
+	
+	def get_game_state_json(self, audience: str = "player") -> str:
+		"""Get game state JSON-encoded, cached per audience until the next mutation"""
+		view = self.get_game_state_dict(audience)
+		encoded = self._views_json.get(audience)
+		if encoded is None:
+			encoded = self._views_json[audience] = json.dumps(view)
+		return encoded
+	
+	def _build_game_state_dict(self, audience: str) -> Dict:
+		"""Serialize the current state into the frontend's JSON shape"""
+		ids = self.public_ids(audience)
+		state = {
+			"room_id": self.room_id,
+			"version": self.version,
+			"players": [p.to_dict(audience) for p in self.players.values()],
+			"current_round": self.current_round,
+			"phase": self.phase,
+			"prompt": self.prompt,
+			"responses": [r.to_dict(ids) for r in self.responses.values()] if self.phase in ["voting", "results"] else [],
+			"votes": [v.to_dict(ids) for v in self.votes.values()] if self.phase == "results" else [],
+			"ai_player_id": self.ai_player_id if audience == "reveal" else None,
+			"timer_end": self._timer_end_iso
+		}
+		state.update(self._summary_fields(audience))
+		return state
 
+	def memory_size(self) -> int:
+		"""Approximate bytes held by this room, cached encodings included.
 
-# Global game state storage
-games: Dict[str, GameState] = {}
+		Walks the object graph with sys.getsizeof; objects shared by every
+		room (prompt catalog strings, None, bools) aren't counted.
+		"""
+		shared = _SHARED_OBJECT_IDS
+		seen = set()
+		stack = [self]
+		total = 0
+		while stack:
+			obj = stack.pop()
+			obj_id = id(obj)
+			if obj_id in seen or obj_id in shared or obj is None or obj.__class__ is bool:
+				continue
+			if obj.__class__ is int and -5 <= obj <= 256:
+				continue  # Cached by the interpreter
+			seen.add(obj_id)
+			total += sys.getsizeof(obj)
+			if isinstance(obj, dict):
+				stack.extend(obj.keys())
+				stack.extend(obj.values())
+			elif isinstance(obj, (list, tuple, set, frozenset)):
+				stack.extend(obj)
+			elif hasattr(obj, "__slots__"):
+				stack.extend(getattr(obj, name) for name in obj.__slots__ if hasattr(obj, name))
+			elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+				# Attribute names are interned and shared by every instance
+				total += sys.getsizeof(obj.__dict__)
+				stack.extend(obj.__dict__.values())
+		return total
 
-def create_room() -> str:
-	"""Create a new game room with unique ID"""
-	room_id = f"{random.randint(100000, 999999)}"
-	while room_id in games:
-		room_id = f"{random.randint(100000, 999999)}"
-	
-	games[room_id] = GameState(room_id)
-	return room_id
+	def _state_row(self) -> tuple:
+		"""Current state as a flat tuple of scalars, without the event log"""
+		return (
+			self.room_id, self.version, self.phase, self.current_round, self.prompt, self.ai_player_id,
+			self.timer_end,
+			self.created_at,
+			# Monotonic clocks don't survive a process, so store wall-clock time
+			time.time() - (time.monotonic() - self.last_activity),
+			tuple(
+				(p.id, p.name, p.is_ai, p.alive, p.joined_at, p.anonymous_number, p.display_name, p.disconnected, p.left)
+				for p in self.players.values()
+			),
+			tuple((r.player_id, r.text, r.timestamp) for r in self.responses.values()),
+			tuple((v.voter_id, v.target_id, v.type, v.timestamp) for v in self.votes.values())
+		)
+
+	def to_snapshot_row(self) -> tuple:
+		"""Full internal state as a flat tuple, for game stores and snapshots.
+
+		Positional, with timestamps as POSIX seconds, so it marshals (or
+		JSON-encodes) compactly and restores without parsing. The state is
+		followed by the log base, the event log of the current game and the
+		prompt deck.
+		"""
+		deck = tuple(self.prompt_deck) if self.prompt_deck else None
+		return self._state_row() + (self.log_base, tuple(self.log), deck)
+
+	@classmethod
+	def from_snapshot_row(cls, row: tuple) -> "GameState":
+		"""Rebuild a game from to_snapshot_row() output"""
+		game = cls._from_state_row(row)
+		game.log_base = row[12]
+		game.log = list(row[13])
+		if len(row) > 14 and row[14]:
+			game.prompt_deck = PromptDeck(*row[14])
+		return game
+
+	@classmethod
+	def _from_state_row(cls, row: tuple) -> "GameState":
+		(room_id, version, phase, current_round, prompt, ai_player_id, timer_end, created_at,
+			last_active_at, players, responses, votes) = row[:12]
 
-def get_game(room_id: str) -> Optional[GameState]:
-	"""Get game by room ID"""
-	return games.get(room_id)
+		game = cls(room_id)
+		game.phase = phase
+		game.current_round = current_round
+		game.prompt = prompt
+		game.ai_player_id = ai_player_id
+		game._set_timer(timer_end)
+		game.created_at = created_at
+		game.last_activity = time.monotonic() - (time.time() - last_active_at)
 
-def cleanup_old_games():
-	"""Remove games older than 2 hours"""
-	cutoff = datetime.now() - timedelta(hours=2)
-	old_rooms = [
-		room_id for room_id, game in games.items()
-		if game.created_at < cutoff
-	]
+		alive_count = 0
+		for pid, name, is_ai, alive, joined_at, anonymous_number, display_name, disconnected, *left in players:
+			# Rows from before presence tracking only set disconnected on leaving
+			left = left[0] if left else disconnected
+			game.players[pid] = Player(pid, name, is_ai, alive, joined_at, anonymous_number, display_name, disconnected, left)
+			alive_count += alive
+		for pid, text, timestamp in responses:
+			game.responses[pid] = Response(pid, text, timestamp)
+		for voter_id, target_id, vote_type, timestamp in votes:
+			game.votes[voter_id] = Vote(voter_id, target_id, vote_type, timestamp)
+			game._count_vote(target_id, vote_type, 1)
+
+		game._alive_count = alive_count
+		game.version = game.stored_version = game._patch_base = version
+		return game
+
+
+# Objects every room points at without owning, skipped by memory_size()
+_SHARED_OBJECT_IDS = frozenset(id(prompt) for prompt in catalog.prompts) | frozenset(
+	id(value) for value in (
+		# Phases, vote types and event kinds
+		"waiting", "response", "voting", "results", "game_over", "kick", "trust", ALL_PROMPTS,
+		"join", "leave", "presence", "start", "respond", "vote", "round", "reset",
+	) + AI_NAMES
+)
+
+
+class RoomCodeAllocator:
+	"""Hands out unused six-digit room codes in O(1).
+	
+	The code space is kept as an in-place Fisher-Yates shuffle: the first
+	`allocated` slots hold codes in use and the rest are free. Allocating
+	swaps a uniformly random free code into the used region; releasing swaps
+	a code back out. Memory is fixed (two uint32 arrays over the space) no
+	matter how much churn there is.
+	"""
+	
+	def __init__(self, low: int = 100000, high: int = 999999):
+		self.low = low
+		self.size = high - low + 1
+		self.allocated = 0
+		self._codes: Optional[array] = None  # slot -> code offset
+		self._slots: Optional[array] = None  # code offset -> slot
+	
+	def _ensure_tables(self):
+		# Built lazily so importing the module stays cheap
+		if self._codes is None:
+			self._codes = array("I", range(self.size))
+			self._slots = array("I", range(self.size))
+	
+	def _swap(self, i: int, j: int):
+		codes, slots = self._codes, self._slots
+		code_i, code_j = codes[i], codes[j]
+		codes[i], codes[j] = code_j, code_i
+		slots[code_j], slots[code_i] = i, j
+	
+	def allocate(self) -> str:
+		"""Reserve a random unused code"""
+		if self.allocated >= self.size:
+			raise RuntimeError("No free room codes left")
+		self._ensure_tables()
+		
+		# Unpredictable pick so live codes can't be guessed from recent ones
+		self._swap(self.allocated, self.allocated + secrets.randbelow(self.size - self.allocated))
+		code = self._codes[self.allocated]
+		self.allocated += 1
+		return str(self.low + code)
 	
-	for room_id in old_rooms:
-		del games[room_id]
\ No newline at end of file
+	def release(self, room_id: str) -> bool:
+		"""Return a code to the free pool"""
+		try:
+			code = int(room_id) - self.low
+		except ValueError:
+			return False
+		if self._codes is None or not 0 <= code < self.size:
+			return False
+		
+		slot = self._slots[code]
+		if slot >= self.allocated:
+			return False  # Not allocated
+		
+		self.allocated -= 1
+		self._swap(slot, self.allocated)
+		return True
+	
+	def reserve(self, room_id: str) -> bool:
+		"""Mark a specific code as taken, e.g. one allocated by another worker"""
+		code = int(room_id) - self.low
+		if not 0 <= code < self.size:
+			return False
+		self._ensure_tables()
+		
+		slot = self._slots[code]
+		if slot < self.allocated:
+			return False  # Already taken
+		
+		self._swap(slot, self.allocated)
+		self.allocated += 1
+		return True
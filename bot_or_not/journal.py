@@ -0,0 +1,59 @@
+"""Append-only journal of room events, for crash recovery of in-memory rooms.
+
+Complements the shutdown snapshot: every save appends the room's new
+events, so after a crash rooms are rebuilt from the last snapshot plus the
+journal. A clean shutdown writes a fresh snapshot and empties the journal.
+
+Records are a 4-byte length and a marshalled (room_id, version, event)
+tuple, where version is the room's version after the event. Besides
+GameState events the journal holds ("create", created_at) with version 0
+and ("drop",) for evicted rooms.
+"""
+
+import marshal
+import os
+import struct
+from typing import Iterator, Tuple
+
+_LENGTH = struct.Struct("!I")
+
+
+class EventJournal:
+	def __init__(self, path: str):
+		self.path = path
+		self._file = open(path, "ab")
+
+	def append(self, room_id: str, version: int, event: tuple):
+		data = marshal.dumps((room_id, version, event))
+		self._file.write(_LENGTH.pack(len(data)) + data)
+
+	def flush(self):
+		"""Hand buffered records to the OS, so they survive a process crash"""
+		self._file.flush()
+
+	def size(self) -> int:
+		return self._file.tell()
+
+	def truncate(self):
+		"""Drop every record, once a snapshot covers them"""
+		self._file.seek(0)
+		self._file.truncate()
+
+	def close(self):
+		self._file.close()
+
+
+def read_journal(path: str) -> Iterator[Tuple[str, int, tuple]]:
+	"""Yield the records of a journal; a torn final record is ignored"""
+	if not os.path.exists(path):
+		return
+	with open(path, "rb") as f:
+		while True:
+			header = f.read(_LENGTH.size)
+			if len(header) < _LENGTH.size:
+				return
+			(length,) = _LENGTH.unpack(header)
+			data = f.read(length)
+			if len(data) < length:
+				return
+			yield marshal.loads(data)
@@ -1,17 +1,31 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import json
 import asyncio
-from typing import Dict, List
+import heapq
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union
 import uuid
 import logging
+import math
 import os
 import random
+import secrets
+import time
 from pathlib import Path
 
-from .game_logic import create_room, get_game, cleanup_old_games
+from contextlib import asynccontextmanager
+
+from .broker import Broker, RoomMessage, make_broker
+from .game_logic import GameState
+from .journal import EventJournal, read_journal
+from .prompts import ALL_PROMPTS, catalog as prompt_catalog
+from .ratelimit import RateLimitMiddleware, TokenBuckets, parse_limit, parse_networks
+from .snapshot import read_snapshot, write_snapshot
+from .store import StaleGameError, store, create_room, get_game, get_games, save_game, cleanup_old_games, room_memory_stats
+from .wire import MsgpackWire, PlayerHandles, SSEWire, choose_subprotocol
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,6 +34,42 @@ logger = logging.getLogger(__name__)
 # FastAPI app
 app = FastAPI(title="Bot or Not Game", version="1.0.0")
 
+# Rate limits as "<requests>/<seconds>", also the burst allowed; "0" turns
+# one off. Buckets are kept for up to RATE_LIMIT_MAX_KEYS clients per limit.
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 10000))
+
+def rate_limit(name: str, default: str) -> Optional[TokenBuckets]:
+    limit = parse_limit(os.getenv(name, default))
+    if limit is None:
+        return None
+    rate, burst = limit
+    return TokenBuckets(rate, burst, RATE_LIMIT_MAX_KEYS)
+
+def _limited(routes: Dict[str, Optional[TokenBuckets]]) -> Dict[str, TokenBuckets]:
+    return {path: buckets for path, buckets in routes.items() if buckets is not None}
+
+SUBMIT_IP_LIMIT = rate_limit("RATE_LIMIT_SUBMIT_IP", "300/60")
+IP_RATE_LIMITS = _limited({
+    "/create-room": rate_limit("RATE_LIMIT_CREATE_ROOM", "10/60"),
+    "/join-room": rate_limit("RATE_LIMIT_JOIN_ROOM", "30/60"),
+    "/submit-response": SUBMIT_IP_LIMIT,
+    "/submit-vote": SUBMIT_IP_LIMIT,
+})
+# Shared by the HTTP routes and the matching WebSocket commands
+PLAYER_RATE_LIMITS = _limited({
+    "/submit-response": rate_limit("RATE_LIMIT_SUBMIT_RESPONSE", "5/10"),
+    "/submit-vote": rate_limit("RATE_LIMIT_SUBMIT_VOTE", "10/10"),
+})
+# Proxies (IPs or CIDR ranges) whose X-Forwarded-For names the client to
+# limit by IP; behind a proxy that is not listed, all clients share its IP
+TRUSTED_PROXIES = parse_networks(os.getenv("TRUSTED_PROXIES", ""))
+app.add_middleware(
+    RateLimitMiddleware,
+    ip_limits=IP_RATE_LIMITS,
+    player_limits=PLAYER_RATE_LIMITS,
+    trusted_proxies=TRUSTED_PROXIES,
+)
+
 # Get the directory containing this file
 BASE_DIR = Path(__file__).parent.parent
 STATIC_DIR = BASE_DIR / "static"
@@ -37,43 +87,606 @@ def get_ai_bot():
         logger.error(f"Failed to initialize AI bot: {e}")
         return None
 
+# Messages a connection may have queued before it is considered too slow
+SEND_QUEUE_LIMIT = 64
+
+# Server heartbeat: every WS_PING_INTERVAL seconds each socket is sent a ping,
+# and a socket that sent nothing (pong or otherwise) for the interval plus
+# WS_PONG_TIMEOUT is treated as dead and evicted
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", 20))
+WS_PONG_TIMEOUT = float(os.getenv("WS_PONG_TIMEOUT", 20))
+PING_MESSAGE = json.dumps({"type": "ping"})
+
+# Seconds a room's state-update broadcasts are held so a burst of them goes
+# out as one frame; 0 sends each immediately. Phase changes are never held.
+BROADCAST_COALESCE_WINDOW = float(os.getenv("BROADCAST_COALESCE_MS", 0)) / 1000
+
+# Events that only tell clients the state changed, so that several of them
+# can be sent as the last one with a patch covering all their changes
+COALESCED_EVENTS = frozenset({"response_received", "vote_received", "player_presence"})
+
+# Events after which players appear under new ids, so that each player is
+# sent one telling them their own
+PERSONAL_EVENTS = frozenset({"game_started"})
+
+# Spectator sockets allowed per room on each worker
+MAX_SPECTATORS = int(os.getenv("MAX_SPECTATORS", 10000))
+
+# Room messages kept per room for clients resuming with ?since=<version>
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", 32))
+
+# Whether clients may negotiate permessage-deflate compression
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "1") != "0"
+
+# The /stats endpoints list room codes and walk rooms on the event loop, so
+# they are only served with "Authorization: Bearer <STATS_TOKEN>". Memory is
+# estimated from a sample of MEMORY_STATS_SAMPLE rooms (0 walks them all).
+STATS_TOKEN = os.getenv("STATS_TOKEN", "")
+MEMORY_STATS_SAMPLE = int(os.getenv("MEMORY_STATS_SAMPLE", 1000))
+
+class Connection:
+    """A player's socket and its bounded outbound queue.
+    
+    send() only queues; the connection's writer task does the network I/O,
+    so a slow client delays nobody but itself. When the queue is full the
+    queued messages are dropped and the connection needs a resync: the
+    writer sends one fresh snapshot once it catches up, and messages that
+    arrive in the meantime are dropped too, since the snapshot covers them.
+    
+    Messages are JSON text; a connection that negotiated MessagePack has a
+    wire that transcodes them into binary frames, and a Server-Sent Events
+    stream one that wraps them in events. Spectators have no player_id.
+    """
+    def __init__(self, websocket: WebSocket, room_id: str, player_id: Optional[str], manager: "ConnectionManager",
+                 wire: Optional[Union[MsgpackWire, SSEWire]] = None):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.player_id = player_id
+        self.wire = wire
+        self.needs_resync = False
+        self.last_seen = time.monotonic()
+        self._closing = False
+        self._manager = manager
+        self._queue: Deque[Union[str, bytes]] = deque()
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+    
+    def send(self, message: str, version: Optional[int] = None):
+        """Queue a JSON message, in this connection's wire format; version
+        is the room version a room message or snapshot brings the client to"""
+        if self.wire is not None:
+            self.send_frame(self.wire.encode(message, self.player_id, version))
+        else:
+            self.send_frame(message)
+    
+    def send_frame(self, frame: Union[str, bytes]):
+        """Queue a message already in this connection's wire format"""
+        if self.needs_resync:
+            return
+        if len(self._queue) >= SEND_QUEUE_LIMIT:
+            logger.warning(f"Send queue of {self.player_id} in room {self.room_id} overflowed, resyncing")
+            self._queue.clear()
+            self.needs_resync = True
+        else:
+            self._queue.append(frame)
+        self._ready.set()
+    
+    async def _write_loop(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue:
+                    await self._send_frame(self._queue.popleft())
+                if self.needs_resync:
+                    await self._resync()
+                if self._closing:
+                    await self._close_socket(code=1000)
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending to {self.player_id} in room {self.room_id}, dropping connection: {e}")
+            if self.player_id is None:
+                self._manager.unwatch(self)
+            else:
+                self._manager.disconnect(self.room_id, self.player_id, self)
+                room_tasks.spawn(self.room_id, update_presence(self.room_id, self.player_id))
+            await self._close_socket(code=1011)
+    
+    async def _resync(self):
+        # Encoded under the room lock so it is ordered with the room's broadcasts
+        async with room_locks.hold(self.room_id):
+            self.needs_resync = False
+            game = get_game(self.room_id)
+            message = encode_snapshot(game, self.player_id) if game else None
+        if message:
+            await self._send_frame(self.wire.encode(message, self.player_id, game.version) if self.wire else message)
+    
+    async def _send_frame(self, frame: Union[str, bytes]):
+        if frame.__class__ is bytes:
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+    
+    def stop(self):
+        """Stop the writer; queued messages are dropped"""
+        # The writer stops itself when a send fails, and still closes the socket
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+    
+    def close_when_sent(self):
+        """Close the socket once the queued messages are sent"""
+        self._closing = True
+        self._ready.set()
+    
+    async def close(self, code: int = 1000):
+        self.stop()
+        await self._close_socket(code)
+    
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # Already closed by the client
+
+class EventStream:
+    """Stands in for the socket of a Server-Sent Events connection.
+    
+    The connection's writer hands each frame to the streaming response
+    through it, one at a time, so a slow stream backs up into the
+    connection's queue like a slow socket would.
+    """
+    def __init__(self):
+        self._frames: asyncio.Queue = asyncio.Queue()
+    
+    async def send_text(self, frame: str):
+        await self._frames.put(frame)
+        await self._frames.join()
+    
+    async def close(self, code: int = 1000):
+        self._frames.put_nowait(None)
+    
+    async def frames(self, connection: Connection):
+        while True:
+            frame = await self._frames.get()
+            if frame is None:
+                return
+            yield frame
+            # Written out, which is all a one-way stream can tell of its client
+            connection.last_seen = time.monotonic()
+            self._frames.task_done()
+
+SSE_WIRE = SSEWire()
+
 # WebSocket connection manager
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
+    """Sockets connected to this worker.
+    
+    Room broadcasts go through the broker, which hands each message to every
+    worker holding sockets in the room; each worker then queues it on its
+    own connections in deliver_local.
     
-    async def connect(self, websocket: WebSocket, room_id: str, player_id: str):
-        await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = {}
-        self.active_connections[room_id][player_id] = websocket
+    With a coalescing window, state updates are held in pending_updates
+    until the window closes, and only the last one held is broadcast.
+    
+    The last REPLAY_BUFFER_SIZE messages of each room that had sockets here
+    are kept in recent_messages, until the room is closed or found gone from
+    the store, so a client reconnecting after a dropped socket gets only
+    what it missed.
+    
+    Spectators watch a room without being players in it. They all get the
+    players' view, so each message is one shared frame for all of them, and
+    they are kept apart from the players' connections, in spectators.
+    """
+    def __init__(self, broker: Broker):
+        self.active_connections: Dict[str, Dict[str, Connection]] = {}
+        self.spectators: Dict[str, Set[Connection]] = {}
+        # Player handles of rooms with MessagePack connections
+        self.handles: Dict[str, PlayerHandles] = {}
+        # room_id -> (event_type, fields) of the update held for the window
+        self.pending_updates: Dict[str, Tuple[str, Dict]] = {}
+        self.recent_messages: Dict[str, Deque[RoomMessage]] = {}
+        self.broker = broker
+        broker.attach(self.deliver_local)
+    
+    def _open(self, room_id: str):
+        """Subscribe to a room when it gets its first socket here"""
+        if room_id not in self.active_connections and room_id not in self.spectators:
+            self.broker.subscribe(room_id)
+            if room_id not in self.recent_messages:
+                self.recent_messages[room_id] = deque(maxlen=REPLAY_BUFFER_SIZE)
+    
+    async def _accept(self, websocket: WebSocket, room_id: str) -> Optional[MsgpackWire]:
+        """Accept a socket in the negotiated wire format"""
+        subprotocol = choose_subprotocol(websocket.scope.get("subprotocols", ()))
+        await websocket.accept(subprotocol=subprotocol)
+        self._open(room_id)
+        if subprotocol is None:
+            return None
+        return MsgpackWire(self.handles.setdefault(room_id, PlayerHandles()))
+    
+    def _release(self, room_id: str):
+        """Unsubscribe from a room once it has no sockets here"""
+        if room_id not in self.active_connections and room_id not in self.spectators:
+            self.handles.pop(room_id, None)
+            self.broker.unsubscribe(room_id)
+    
+    async def connect(self, websocket: WebSocket, room_id: str, player_id: str) -> Connection:
+        wire = await self._accept(websocket, room_id)
+        return self._add(Connection(websocket, room_id, player_id, self, wire))
+    
+    def connect_stream(self, stream: "EventStream", room_id: str, player_id: str) -> Connection:
+        """Add a player's Server-Sent Events stream, which stands in for a socket"""
+        self._open(room_id)
+        return self._add(Connection(stream, room_id, player_id, self, SSE_WIRE))
+    
+    def _add(self, connection: Connection) -> Connection:
+        room_id, player_id = connection.room_id, connection.player_id
+        connections = self.active_connections.setdefault(room_id, {})
+        previous = connections.get(player_id)
+        if previous:
+            # Reconnected; the old socket's writer has nothing left to do
+            previous.stop()
+        connections[player_id] = connection
         logger.info(f"Player {player_id} connected to room {room_id}")
+        return connection
     
-    def disconnect(self, room_id: str, player_id: str):
-        if room_id in self.active_connections:
-            self.active_connections[room_id].pop(player_id, None)
-            if not self.active_connections[room_id]:
+    def disconnect(self, room_id: str, player_id: str, connection: Optional[Connection] = None, close: bool = False):
+        """Forget a player's connection, only if it is still `connection` when
+        given; with close, its socket is closed once its queue is sent"""
+        connections = self.active_connections.get(room_id)
+        if connections is not None:
+            current = connections.get(player_id)
+            if current is not None and (connection is None or current is connection):
+                if close:
+                    current.close_when_sent()
+                else:
+                    current.stop()
+                del connections[player_id]
+            if not connections:
                 del self.active_connections[room_id]
+                self._release(room_id)
         logger.info(f"Player {player_id} disconnected from room {room_id}")
     
+    async def watch(self, websocket: WebSocket, room_id: str) -> Optional[Connection]:
+        """Add a spectator socket, or turn it away when the room has too many"""
+        spectators = self.spectators.get(room_id, ())
+        if len(spectators) >= MAX_SPECTATORS:
+            await websocket.close(code=1013)
+            return None
+        wire = await self._accept(websocket, room_id)
+        connection = Connection(websocket, room_id, None, self, wire)
+        self.spectators.setdefault(room_id, set()).add(connection)
+        return connection
+    
+    def unwatch(self, connection: Connection):
+        spectators = self.spectators.get(connection.room_id)
+        if spectators is None or connection not in spectators:
+            return
+        connection.stop()
+        spectators.discard(connection)
+        if not spectators:
+            del self.spectators[connection.room_id]
+            self._release(connection.room_id)
+    
     async def send_personal_message(self, message: str, room_id: str, player_id: str):
-        if room_id in self.active_connections and player_id in self.active_connections[room_id]:
+        connection = self.active_connections.get(room_id, {}).get(player_id)
+        if connection:
+            connection.send(message)
+    
+    async def broadcast_to_room(self, message: RoomMessage, room_id: str, exclude_player: str = None):
+        await self.broker.publish(room_id, message, exclude_player)
+    
+    def hold_update(self, room_id: str, event_type: str, fields: Dict) -> bool:
+        """Hold a state update until the room's window closes, replacing any
+        held one; True if the window just opened and needs a flush scheduled"""
+        opened = room_id not in self.pending_updates
+        self.pending_updates[room_id] = (event_type, fields)
+        return opened
+    
+    def take_held_update(self, room_id: str) -> Optional[Tuple[str, Dict]]:
+        return self.pending_updates.pop(room_id, None)
+    
+    def missed_payloads(self, room_id: str, player_id: Optional[str], since: int) -> Optional[List[Tuple[int, str]]]:
+        """Versions and payloads of the room's messages after version
+        `since`, as the player would have received them; None if they no
+        longer reach back that far, or messages in between were never seen here"""
+        recent = self.recent_messages.get(room_id)
+        if recent is None:
+            return None
+        payloads = []
+        version = since
+        for message in recent:
+            if message.version <= since:
+                continue
+            if message.base_version is not None and message.base_version > version:
+                return None
+            payloads.append((message.version, message.payload_for(player_id)))
+            version = message.version
+        return payloads
+    
+    async def deliver_local(self, room_id: str, message: RoomMessage, exclude_player: Optional[str] = None):
+        """Queue an already-encoded room message on this worker's connections"""
+        recent = self.recent_messages.get(room_id)
+        if recent is not None:
+            recent.append(message)
+        transcoded = {}
+        for player_id, connection in self.active_connections.get(room_id, {}).items():
+            if player_id == exclude_player:
+                continue
+            payload = message.payload_for(player_id)
+            if connection.wire is None:
+                connection.send_frame(payload)
+                continue
+            # MessagePack connections of a room share its handles, so each
+            # payload is transcoded once per wire format
+            key = (connection.wire.name, payload)
+            frame = transcoded.get(key)
+            if frame is None:
+                frame = transcoded[key] = connection.wire.encode(payload, version=message.version)
+            connection.send_frame(frame)
+        
+        spectators = self.spectators.get(room_id)
+        if spectators:
+            payload = message.payload_for(None)
+            frame = None
+            for connection in spectators:
+                if connection.wire is None:
+                    connection.send_frame(payload)
+                else:
+                    if frame is None:
+                        frame = transcoded.get((connection.wire.name, payload)) or connection.wire.encode(payload)
+                    connection.send_frame(frame)
+    
+    def is_connected(self, room_id: str, player_id: str) -> bool:
+        return player_id in self.active_connections.get(room_id, {})
+    
+    def connection_counts(self) -> Dict[str, int]:
+        """Open player sockets per room on this worker"""
+        return {room_id: len(connections) for room_id, connections in self.active_connections.items()}
+    
+    def spectator_counts(self) -> Dict[str, int]:
+        return {room_id: len(spectators) for room_id, spectators in self.spectators.items()}
+    
+    def heartbeat(self) -> List[Connection]:
+        """Ping every socket, and forget and return the ones that missed
+        their pongs; the caller closes them"""
+        cutoff = time.monotonic() - WS_PING_INTERVAL - WS_PONG_TIMEOUT
+        dead = []
+        for connections in self.active_connections.values():
+            for connection in connections.values():
+                if connection.last_seen < cutoff:
+                    dead.append(connection)
+                else:
+                    connection.send(PING_MESSAGE)
+        for spectators in self.spectators.values():
+            for connection in spectators:
+                if connection.last_seen < cutoff:
+                    dead.append(connection)
+                else:
+                    connection.send(PING_MESSAGE)
+        for connection in dead:
+            if connection.player_id is None:
+                self.unwatch(connection)
+            else:
+                logger.info(f"Player {connection.player_id} in room {connection.room_id} missed its pongs")
+                self.disconnect(connection.room_id, connection.player_id, connection)
+        return dead
+    
+    def idle_buffers(self) -> List[str]:
+        """Rooms whose replay buffer is kept while no socket here is in them"""
+        return [
+            room_id for room_id in self.recent_messages
+            if room_id not in self.active_connections and room_id not in self.spectators
+        ]
+    
+    async def close_room(self, room_id: str):
+        """Close and forget every socket in a room"""
+        connections = list(self.active_connections.pop(room_id, {}).values())
+        connections.extend(self.spectators.pop(room_id, ()))
+        self.handles.pop(room_id, None)
+        self.pending_updates.pop(room_id, None)
+        self.recent_messages.pop(room_id, None)
+        if connections:
+            self.broker.unsubscribe(room_id)
+        for connection in connections:
+            await connection.close(code=1001)
+
+manager = ConnectionManager(make_broker(os.getenv("ROOM_BROKER", "local")))
+
+# Per-room command serialization
+class RoomLocks:
+    """Registry of per-room locks.
+    
+    Every state transition loads, mutates and saves its room under the
+    room's lock, so HTTP handlers, AI tasks and the phase timer apply each
+    transition exactly once and broadcast in version order. Unrelated rooms
+    never contend. A lock only exists while someone holds or awaits it.
+    """
+    def __init__(self):
+        self._locks: Dict[str, Tuple[asyncio.Lock, List[int]]] = {}
+    
+    @asynccontextmanager
+    async def hold(self, room_id: str):
+        entry = self._locks.get(room_id)
+        if entry is None:
+            entry = self._locks[room_id] = (asyncio.Lock(), [0])
+        lock, users = entry
+        users[0] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            users[0] -= 1
+            if not users[0]:
+                del self._locks[room_id]
+    
+    def __len__(self) -> int:
+        return len(self._locks)
+
+room_locks = RoomLocks()
+
+class RoomTasks:
+    """Background tasks per room, so they can be cancelled when it is evicted"""
+    def __init__(self):
+        self._tasks: Dict[str, Set[asyncio.Task]] = {}
+    
+    def spawn(self, room_id: str, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.setdefault(room_id, set()).add(task)
+        task.add_done_callback(lambda t: self._forget(room_id, t))
+        return task
+    
+    def _forget(self, room_id: str, task: asyncio.Task):
+        tasks = self._tasks.get(room_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._tasks[room_id]
+    
+    def cancel(self, room_id: str):
+        for task in self._tasks.pop(room_id, set()):
+            task.cancel()
+
+room_tasks = RoomTasks()
+
+# Phase deadline scheduler
+class PhaseTimer:
+    """Single task that advances expired phases for every room.
+    
+    Deadlines live in a min-heap of (monotonic deadline, room_id, timer_end),
+    so wall-clock jumps don't move them. Rescheduling just pushes a new
+    entry; stale entries are dropped when popped because the room's
+    timer_end no longer matches.
+    """
+    def __init__(self):
+        self._heap: List[Tuple[float, str, float]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+    
+    def schedule(self, room_id: str, timer_end: Optional[float]):
+        """Register a room's phase deadline (POSIX seconds) in O(log n)"""
+        if timer_end is None:
+            return
+        entry = (time.monotonic() + (timer_end - time.time()), room_id, timer_end)
+        heapq.heappush(self._heap, entry)
+        # Only a new earliest deadline changes how long the loop should sleep
+        if self._wakeup and self._heap[0] is entry:
+            self._wakeup.set()
+    
+    def __len__(self) -> int:
+        return len(self._heap)
+    
+    async def run(self):
+        """Sleep until the earliest deadline, then expire every due room"""
+        self._wakeup = asyncio.Event()
+        while True:
+            now = time.monotonic()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+            
+            if due:
+                # One store round-trip for every room expiring together
+                games = get_games(room_id for _, room_id, _ in due)
+                for _, room_id, timer_end in due:
+                    game = games.get(room_id)
+                    if game and game.timer_end == timer_end:
+                        # Run transitions off the timer loop so slow sockets can't delay it
+                        room_tasks.spawn(room_id, handle_phase_timeout(room_id, timer_end))
+            
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
             try:
-                await self.active_connections[room_id][player_id].send_text(message)
-            except Exception as e:
-                logger.error(f"Error sending message to {player_id}: {e}")
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+phase_timer = PhaseTimer()
+
+def encode_with_state(game: GameState, audience: str, **fields) -> str:
+    """JSON-encode fields plus the audience's cached view of the game without
+    re-serializing it"""
+    body = json.dumps(fields)
+    state = game.get_game_state_json(audience)
+    if body == "{}":
+        return '{"game_state": ' + state + "}"
+    return body[:-1] + ', "game_state": ' + state + "}"
+
+def viewer_fields(game: GameState, viewer: Optional[str]) -> Dict[str, str]:
+    """The id a player appears under in the state they are sent, which is
+    not their own between the start and the end of a game"""
+    player = game.get_player(viewer) if viewer else None
+    if player is None:
+        return {}
+    return {"viewer_id": player.id if game.audience_of(viewer) == "reveal" else player.public_id}
+
+def encode_snapshot(game: GameState, viewer: Optional[str]) -> str:
+    return encode_with_state(game, game.audience_of(viewer), type="snapshot", **viewer_fields(game, viewer))
+
+def encode_event(game: GameState, event_type: str, **fields) -> RoomMessage:
+    """Encode a room event once per audience, as a patch against the last
+    broadcast when possible.
     
-    async def broadcast_to_room(self, message: str, room_id: str, exclude_player: str = None):
-        if room_id in self.active_connections:
-            for player_id, connection in self.active_connections[room_id].items():
-                if exclude_player and player_id == exclude_player:
-                    continue
-                try:
-                    await connection.send_text(message)
-                except Exception as e:
-                    logger.error(f"Error broadcasting to {player_id}: {e}")
+    Falls back to embedding the full state when the changes since the last
+    broadcast include a phase transition or reordering. Events in
+    PERSONAL_EVENTS are also encoded once per player, with their viewer_id.
+    """
+    audiences = game.audiences()
+    patches = game.take_patch(audiences)
+    base_version = None if patches is None else patches[audiences[0]]["base_version"]
+    payloads = {}
+    for audience in audiences:
+        if patches is None:
+            payloads[audience] = encode_with_state(game, audience, type=event_type, **fields)
+        else:
+            payloads[audience] = json.dumps({"type": event_type, **fields, "patch": patches[audience]})
+    # Everyone but the eliminated players gets the first payload
+    spectators = {}
+    if "spectator" in payloads:
+        spectators = {player.id: "spectator" for player in game.players.values() if not player.alive}
+    if event_type in PERSONAL_EVENTS:
+        for player in game.players.values():
+            if not player.is_ai:
+                payloads[player.id] = encode_with_state(
+                    game, game.audience_of(player.id), type=event_type, **fields, **viewer_fields(game, player.id)
+                )
+                spectators[player.id] = player.id
+    return RoomMessage(payloads, spectators, game.version, base_version)
+
+async def publish(room_id: str, game: GameState, event_type: str, exclude_player: str = None, **fields):
+    """Save a room's latest changes, then broadcast them as one event.
+    
+    Within the coalescing window state updates are held and sent later by
+    flush_held_update; any other event is sent at once and supersedes the
+    held update, since its patch or state covers the same changes.
+    """
+    save_game(game)
+    if BROADCAST_COALESCE_WINDOW and event_type in COALESCED_EVENTS and exclude_player is None:
+        if manager.hold_update(room_id, event_type, fields):
+            room_tasks.spawn(room_id, flush_held_update(room_id))
+        return
+    manager.take_held_update(room_id)
+    await manager.broadcast_to_room(
+        encode_event(game, event_type, **fields),
+        room_id,
+        exclude_player=exclude_player
+    )
 
-manager = ConnectionManager()
+async def flush_held_update(room_id: str):
+    await asyncio.sleep(BROADCAST_COALESCE_WINDOW)
+    async with room_locks.hold(room_id):
+        held = manager.take_held_update(room_id)
+        game = get_game(room_id)
+        if held and game:
+            event_type, fields = held
+            await manager.broadcast_to_room(encode_event(game, event_type, **fields), room_id)
+
+def state_response(game: GameState, viewer: Optional[str], **fields) -> Response:
+    """HTTP JSON response embedding the cached state encoding, as seen by
+    the player making the request"""
+    content = encode_with_state(game, game.audience_of(viewer), **fields, **viewer_fields(game, viewer))
+    return Response(content=content, media_type="application/json")
 
 # Pydantic models for API requests
 class CreateRoomRequest(BaseModel):
@@ -94,6 +707,11 @@ class SubmitVoteRequest(BaseModel):
     target_player_id: str
     vote_type: str  # "kick" or "trust"
 
+@app.exception_handler(StaleGameError)
+async def stale_game_handler(request, exc: StaleGameError):
+    """Another worker changed the room first; the client can simply retry"""
+    return JSONResponse(status_code=409, content={"detail": "Room was updated concurrently, please retry"})
+
 # API Routes
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
@@ -108,7 +726,10 @@ async def read_root():
 @app.post("/create-room")
 async def create_game_room(request: CreateRoomRequest):
     """Create a new game room"""
-    room_id = create_room()
+    try:
+        room_id = create_room()
+    except RuntimeError:
+        raise HTTPException(status_code=503, detail="No rooms available, try again later")
     player_id = str(uuid.uuid4())
     
     game = get_game(room_id)
@@ -118,12 +739,9 @@ async def create_game_room(request: CreateRoomRequest):
     success = game.add_player(player_id, request.player_name)
     if not success:
         raise HTTPException(status_code=500, detail="Failed to add player to room")
+    save_game(game)
     
-    return {
-        "room_id": room_id,
-        "player_id": player_id,
-        "game_state": game.get_game_state_dict()
-    }
+    return state_response(game, player_id, room_id=room_id, player_id=player_id)
 
 @app.post("/join-room") 
 async def join_game_room(request: JoinRoomRequest):
@@ -138,38 +756,26 @@ async def join_game_room(request: JoinRoomRequest):
             else:
                 raise HTTPException(status_code=400, detail="Invalid room code format")
         
-        game = get_game(room_id)
-        if not game:
-            logger.warning(f"Room not found: {room_id}")
-            raise HTTPException(status_code=404, detail="Room not found")
-        
         player_id = str(uuid.uuid4())
-        success = game.add_player(player_id, request.player_name)
-        
-        if not success:
-            raise HTTPException(status_code=400, detail="Unable to join room (full or already started)")
-        
-        logger.info(f"Player {player_id} joined room {room_id}")
-        
-        # Get game state and ensure it's serializable
-        game_state = game.get_game_state_dict()
-        
-        # Broadcast player joined to room
-        await manager.broadcast_to_room(
-            json.dumps({
-                "type": "player_joined",
-                "game_state": game_state
-            }),
-            room_id
-        )
-        
-        return {
-            "room_id": room_id,
-            "player_id": player_id,
-            "game_state": game_state
-        }
+        async with room_locks.hold(room_id):
+            game = get_game(room_id)
+            if not game:
+                logger.warning(f"Room not found: {room_id}")
+                raise HTTPException(status_code=404, detail="Room not found")
+            
+            success = game.add_player(player_id, request.player_name)
+            
+            if not success:
+                raise HTTPException(status_code=400, detail="Unable to join room (full or already started)")
+            
+            logger.info(f"Player {player_id} joined room {room_id}")
+            
+            # Broadcast player joined to room
+            await publish(room_id, game, "player_joined")
+            
+            return state_response(game, player_id, room_id=room_id, player_id=player_id)
         
-    except HTTPException:
+    except (HTTPException, StaleGameError):
         # Re-raise HTTP exceptions as-is
         raise
     except Exception as e:
@@ -177,125 +783,172 @@ async def join_game_room(request: JoinRoomRequest):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/room/{room_id}")
-async def get_room_status(room_id: str):
-    """Get current room status"""
+async def get_room_status(room_id: str, player_id: Optional[str] = None):
+    """Get current room status; as seen by player_id when given, wrapped
+    like the join response so it carries their viewer_id"""
     game = get_game(room_id)
     if not game:
         raise HTTPException(status_code=404, detail="Room not found")
     
-    return game.get_game_state_dict()
+    if player_id is not None:
+        return state_response(game, player_id)
+    return Response(content=game.get_game_state_json(game.audience_of(None)), media_type="application/json")
 
-@app.post("/start-game")
-async def start_game(request: dict):
-    """Start the game in a room"""
-    room_id = request.get("room_id")
-    if not room_id:
-        raise HTTPException(status_code=400, detail="room_id is required")
-    
+@app.get("/room/{room_id}/replay")
+async def get_room_replay(room_id: str, step: Optional[int] = None):
+    """Event log of a finished game, or its state after `step` events"""
     game = get_game(room_id)
     if not game:
         raise HTTPException(status_code=404, detail="Room not found")
-    
-    if not game.can_start_game():
-        raise HTTPException(status_code=400, detail="Not enough players to start game")
-    
-    success = game.start_game()
-    if not success:
-        raise HTTPException(status_code=400, detail="Unable to start game")
-    
-    # Broadcast game started
-    await manager.broadcast_to_room(
-        json.dumps({
-            "type": "game_started",
-            "game_state": game.get_game_state_dict()
-        }),
-        room_id
-    )
-    
-    # Generate AI response after a short delay
-    asyncio.create_task(generate_ai_response_delayed(room_id))
-    
-    return {"success": True, "game_state": game.get_game_state_dict()}
+    # The log reveals the AI player, so it is only available once the game is over
+    if game.phase != "game_over":
+        raise HTTPException(status_code=400, detail="Replay is available once the game is over")
 
-@app.post("/submit-response")
-async def submit_response(request: SubmitResponseRequest):
-    """Submit a response to the current prompt"""
-    game = get_game(request.room_id)
-    if not game:
-        raise HTTPException(status_code=404, detail="Room not found")
-    
-    success = game.add_response(request.player_id, request.response_text)
-    if not success:
-        raise HTTPException(status_code=400, detail="Unable to submit response")
-    
-    # Check if we can advance to voting
-    if game.can_advance_to_voting():
-        game.start_voting_phase()
-        await manager.broadcast_to_room(
-            json.dumps({
-                "type": "voting_phase_started",
-                "game_state": game.get_game_state_dict()
-            }),
-            request.room_id
-        )
+    if step is not None:
+        return game.replay(step).get_game_state_dict("reveal")
+    return {
+        "room_id": room_id,
+        "base": game.replay(0).get_game_state_dict("reveal"),
+        "events": game.log
+    }
+
+def require_stats_token(request: Request):
+    """Only operators holding STATS_TOKEN see the /stats endpoints"""
+    if not STATS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("authorization", "")
+    if not secrets.compare_digest(authorization.encode(), f"Bearer {STATS_TOKEN}".encode()):
+        raise HTTPException(status_code=403, detail="Not allowed")
+
+@app.get("/stats/memory")
+async def get_memory_stats(request: Request):
+    """Rooms held by this worker and their approximate memory, total and per phase"""
+    require_stats_token(request)
+    return room_memory_stats(MEMORY_STATS_SAMPLE or None)
+
+@app.get("/stats/connections")
+async def get_connection_stats(request: Request):
+    """Open WebSocket connections of players and spectators per room, on this worker"""
+    require_stats_token(request)
+    counts = manager.connection_counts()
+    spectators = manager.spectator_counts()
+    return {
+        "total": sum(counts.values()),
+        "rooms": counts,
+        "spectators": sum(spectators.values()),
+        "spectator_rooms": spectators,
+    }
+
+@app.get("/prompt-categories")
+async def get_prompt_categories():
+    """Prompt categories a game can be started with, and how many prompts each has"""
+    return prompt_catalog.category_sizes()
+
+# Room commands, shared by the HTTP routes and the WebSocket protocol. Each
+# validates and applies one player action under the room's lock and raises
+# HTTPException when it is rejected.
+async def start_game_command(room_id: str, prompt_category: Optional[str]) -> GameState:
+    async with room_locks.hold(room_id):
+        game = get_game(room_id)
+        if not game:
+            raise HTTPException(status_code=404, detail="Room not found")
         
-        # Generate AI vote after delay
-        asyncio.create_task(generate_ai_vote_delayed(request.room_id))
-    else:
-        # Broadcast that response was received
-        await manager.broadcast_to_room(
-            json.dumps({
-                "type": "response_received", 
-                "game_state": game.get_game_state_dict()
-            }),
-            request.room_id
-        )
-    
-    return {"success": True, "game_state": game.get_game_state_dict()}
+        if not game.can_start_game():
+            raise HTTPException(status_code=400, detail="Not enough players to start game")
+        
+        prompt_category = prompt_category or ALL_PROMPTS
+        if prompt_category not in prompt_catalog:
+            raise HTTPException(status_code=400, detail="Unknown prompt category")
+        
+        success = game.start_game(prompt_category)
+        if not success:
+            raise HTTPException(status_code=400, detail="Unable to start game")
+        
+        phase_timer.schedule(room_id, game.timer_end)
+        
+        # Broadcast game started
+        await publish(room_id, game, "game_started")
+        
+        # Generate AI response after a short delay
+        room_tasks.spawn(room_id, generate_ai_response_delayed(room_id))
+        return game
 
-@app.post("/submit-vote")
-async def submit_vote(request: SubmitVoteRequest):
-    """Submit a vote for kick/trust"""
-    try:
-        game = get_game(request.room_id)
+async def submit_response_command(room_id: str, player_id: str, response_text: str) -> GameState:
+    async with room_locks.hold(room_id):
+        game = get_game(room_id)
         if not game:
             raise HTTPException(status_code=404, detail="Room not found")
         
-        success = game.add_vote(request.player_id, request.target_player_id, request.vote_type)
+        success = game.add_response(player_id, response_text)
         if not success:
-            raise HTTPException(status_code=400, detail="Unable to submit vote")
+            raise HTTPException(status_code=400, detail="Unable to submit response")
         
-        # Get serializable game state
-        game_state = game.get_game_state_dict()
+        # Check if we can advance to voting
+        if game.can_advance_to_voting():
+            await begin_voting(room_id, game)
+        else:
+            # Broadcast that response was received
+            await publish(room_id, game, "response_received")
+        return game
+
+async def submit_vote_command(room_id: str, player_id: str, target_player_id: str, vote_type: str) -> GameState:
+    async with room_locks.hold(room_id):
+        game = get_game(room_id)
+        if not game:
+            raise HTTPException(status_code=404, detail="Room not found")
+        
+        # Players know each other by their in-game ids
+        success = game.add_vote(player_id, game.player_id_for(target_player_id), vote_type)
+        if not success:
+            raise HTTPException(status_code=400, detail="Unable to submit vote")
         
         # Check if we can advance to results
         if game.can_advance_to_results():
-            results = game.calculate_round_results()
-            
-            await manager.broadcast_to_room(
-                json.dumps({
-                    "type": "round_results",
-                    "results": results,
-                    "game_state": game_state
-                }),
-                request.room_id
-            )
-            
-            # Check win condition and advance to next round after delay
-            asyncio.create_task(advance_round_delayed(request.room_id))
+            await finish_voting(room_id, game)
         else:
             # Broadcast that vote was received
-            await manager.broadcast_to_room(
-                json.dumps({
-                    "type": "vote_received",
-                    "game_state": game_state
-                }),
-                request.room_id
-            )
+            await publish(room_id, game, "vote_received")
+        return game
+
+async def leave_room_command(room_id: str, player_id: str):
+    async with room_locks.hold(room_id):
+        game = get_game(room_id)
+        if not game:
+            raise HTTPException(status_code=404, detail="Room not found")
         
-        return {"success": True, "game_state": game_state}
+        success = game.remove_player(player_id)
+        if not success:
+            raise HTTPException(status_code=400, detail="Player not found in room")
         
-    except HTTPException:
+        # Broadcast player left to remaining players
+        await publish(room_id, game, "player_left", exclude_player=player_id)
+
+@app.post("/start-game")
+async def start_game(request: dict):
+    """Start the game in a room"""
+    room_id = request.get("room_id")
+    if not room_id:
+        raise HTTPException(status_code=400, detail="room_id is required")
+    
+    game = await start_game_command(room_id, request.get("prompt_category"))
+    return state_response(game, request.get("player_id"), success=True)
+
+@app.post("/submit-response")
+async def submit_response(request: SubmitResponseRequest):
+    """Submit a response to the current prompt"""
+    game = await submit_response_command(request.room_id, request.player_id, request.response_text)
+    return state_response(game, request.player_id, success=True)
+
+@app.post("/submit-vote")
+async def submit_vote(request: SubmitVoteRequest):
+    """Submit a vote for kick/trust"""
+    try:
+        game = await submit_vote_command(
+            request.room_id, request.player_id, request.target_player_id, request.vote_type
+        )
+        return state_response(game, request.player_id, success=True)
+        
+    except (HTTPException, StaleGameError):
         raise
     except Exception as e:
         logger.error(f"Unexpected error in submit_vote: {e}")
@@ -310,26 +963,10 @@ async def leave_room(request: dict):
     if not room_id or not player_id:
         raise HTTPException(status_code=400, detail="room_id and player_id are required")
     
-    game = get_game(room_id)
-    if not game:
-        raise HTTPException(status_code=404, detail="Room not found")
-    
-    success = game.remove_player(player_id)
-    if not success:
-        raise HTTPException(status_code=400, detail="Player not found in room")
-    
-    # Broadcast player left to remaining players
-    await manager.broadcast_to_room(
-        json.dumps({
-            "type": "player_left",
-            "game_state": game.get_game_state_dict()
-        }),
-        room_id,
-        exclude_player=player_id
-    )
+    await leave_room_command(room_id, player_id)
     
     # Close WebSocket connection for the leaving player
-    manager.disconnect(room_id, player_id)
+    manager.disconnect(room_id, player_id, close=True)
     
     return {"success": True}
 
@@ -341,43 +978,280 @@ async def reset_room(request: dict):
     if not room_id:
         raise HTTPException(status_code=400, detail="room_id is required")
     
-    game = get_game(room_id)
-    if not game:
+    async with room_locks.hold(room_id):
+        game = get_game(room_id)
+        if not game:
+            raise HTTPException(status_code=404, detail="Room not found")
+        
+        success = game.reset_to_lobby()
+        if not success:
+            raise HTTPException(status_code=400, detail="Cannot reset room")
+        
+        # Broadcast room reset to all players
+        await publish(room_id, game, "room_reset")
+        
+        return state_response(game, request.get("player_id"), success=True)
+
+async def receive_message(connection: Connection) -> Dict:
+    """Next message from a socket, in its wire format"""
+    if connection.wire is None:
+        message = json.loads(await connection.websocket.receive_text())
+    else:
+        message = connection.wire.decode(await connection.websocket.receive_bytes())
+    # Anything received, including the pong to our heartbeat ping, shows
+    # the connection is alive
+    connection.last_seen = time.monotonic()
+    return message
+
+# Server-Sent Events endpoint
+@app.get("/events/{room_id}/{player_id}")
+async def event_stream(request: Request, room_id: str, player_id: str, since: Optional[int] = None):
+    """Fallback for clients that cannot open a WebSocket: the player's room
+    messages as Server-Sent Events, resuming after Last-Event-ID when the
+    browser reconnects. Commands go through the HTTP routes."""
+    if not get_game(room_id):
         raise HTTPException(status_code=404, detail="Room not found")
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
     
-    success = game.reset_to_lobby()
-    if not success:
-        raise HTTPException(status_code=400, detail="Cannot reset room")
+    stream = EventStream()
+    connection = manager.connect_stream(stream, room_id, player_id)
+    if since is None:
+        await send_snapshot(connection)
+    else:
+        await send_missed(connection, since)
+    await update_presence(room_id, player_id)
     
-    # Broadcast room reset to all players
-    await manager.broadcast_to_room(
-        json.dumps({
-            "type": "room_reset",
-            "game_state": game.get_game_state_dict()
-        }),
-        room_id
+    async def events():
+        try:
+            async for frame in stream.frames(connection):
+                yield frame
+        finally:
+            manager.disconnect(room_id, player_id, connection)
+            room_tasks.spawn(room_id, update_presence(room_id, player_id))
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+
+# Spectator endpoint, ahead of the player endpoint whose path it would match
+@app.websocket("/ws/{room_id}/spectate")
+async def spectate_endpoint(websocket: WebSocket, room_id: str, since: Optional[int] = None):
+    """Watch a room without joining it: the players' view, read-only"""
+    if not get_game(room_id):
+        await websocket.close(code=1008)
+        return
+    connection = await manager.watch(websocket, room_id)
+    if connection is None:
+        return
+    
+    try:
+        # Handles from before a reconnect may mean other players now
+        if since is None or connection.wire is not None:
+            await send_snapshot(connection)
+        else:
+            await send_missed(connection, since)
+        
+        while True:
+            message = await receive_message(connection)
+            if message.get("type") == "ping":
+                connection.send(json.dumps({"type": "pong"}))
+            elif message.get("type") == "sync":
+                await send_snapshot(connection)
     
-    return {"success": True, "game_state": game.get_game_state_dict()}
+    except WebSocketDisconnect:
+        manager.unwatch(connection)
 
 # WebSocket endpoint
 @app.websocket("/ws/{room_id}/{player_id}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str, player_id: str):
-    await manager.connect(websocket, room_id, player_id)
+async def websocket_endpoint(websocket: WebSocket, room_id: str, player_id: str, since: Optional[int] = None):
+    if not get_game(room_id):
+        await websocket.close(code=1008)
+        return
+    connection = await manager.connect(websocket, room_id, player_id)
     
     try:
+        # Start every connection from a full snapshot, or a resuming client
+        # from the messages it missed; later events are patches. MessagePack
+        # handles are only kept while the room has sockets on this worker,
+        # so those clients always start over
+        if since is None or connection.wire is not None:
+            await send_snapshot(connection)
+        else:
+            await send_missed(connection, since)
+        await update_presence(room_id, player_id)
+        
         while True:
             # Keep connection alive and handle any messages
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            message = await receive_message(connection)
             
             # Handle ping messages to keep connection alive
             if message.get("type") == "ping":
-                await websocket.send_text(json.dumps({"type": "pong"}))
+                connection.send(json.dumps({"type": "pong"}))
+            
+            # Client missed a version and cannot apply the latest patch
+            elif message.get("type") == "sync":
+                await send_snapshot(connection)
+            
+            elif message.get("type") in WS_COMMANDS:
+                await run_ws_command(connection, message)
             
     except WebSocketDisconnect:
-        manager.disconnect(room_id, player_id)
-        logger.info(f"Player {player_id} disconnected from room {room_id}")
+        manager.disconnect(room_id, player_id, connection)
+        await update_presence(room_id, player_id)
+
+async def update_presence(room_id: str, player_id: str):
+    """Mark a player connected or disconnected in the game to match whether
+    this worker holds a socket for them, and tell the room if that changed"""
+    async with room_locks.hold(room_id):
+        game = get_game(room_id)
+        if not game:
+            return
+        connected = manager.is_connected(room_id, player_id)
+        if game.set_presence(player_id, connected):
+            await publish(room_id, game, "player_presence", player_id=player_id, connected=connected)
+
+async def reap_connection(connection: Connection):
+    await connection.close(code=1011)
+    if connection.player_id is not None:
+        await update_presence(connection.room_id, connection.player_id)
+
+def _command_field(message: Dict, name: str, required: bool = True) -> Optional[str]:
+    value = message.get(name)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or not value:
+        raise HTTPException(status_code=400, detail=f"{name} is required")
+    return value
+
+async def _ws_start_game(connection: Connection, message: Dict):
+    await start_game_command(connection.room_id, _command_field(message, "prompt_category", required=False))
+
+async def _ws_submit_response(connection: Connection, message: Dict):
+    await submit_response_command(connection.room_id, connection.player_id, _command_field(message, "response_text"))
+
+async def _ws_submit_vote(connection: Connection, message: Dict):
+    await submit_vote_command(
+        connection.room_id, connection.player_id,
+        _command_field(message, "target_player_id"), _command_field(message, "vote_type")
+    )
+
+async def _ws_leave(connection: Connection, message: Dict):
+    await leave_room_command(connection.room_id, connection.player_id)
+
+# Commands a client can send over its socket, acting as the socket's player.
+# Each is answered with {"type": "ack", "id": <the command's id>, "success": ...}
+# plus "status" and "detail" on failure, as the HTTP route would return;
+# the resulting state arrives as the usual broadcast, before the ack unless
+# it is held for the coalescing window.
+WS_COMMANDS = {
+    "start_game": _ws_start_game,
+    "submit_response": _ws_submit_response,
+    "submit_vote": _ws_submit_vote,
+    "leave": _ws_leave,
+}
+
+# Commands limited like their HTTP routes, per player
+WS_COMMAND_ROUTES = {
+    "submit_response": "/submit-response",
+    "submit_vote": "/submit-vote",
+}
+
+async def run_ws_command(connection: Connection, message: Dict):
+    kind = message["type"]
+    ack = {"type": "ack", "id": message.get("id"), "success": True}
+    try:
+        buckets = PLAYER_RATE_LIMITS.get(WS_COMMAND_ROUTES.get(kind))
+        retry_after = buckets.take(connection.player_id) if buckets else 0
+        if retry_after:
+            raise HTTPException(status_code=429, detail="Too many requests, slow down",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
+        await WS_COMMANDS[kind](connection, message)
+    except HTTPException as e:
+        ack.update(success=False, status=e.status_code, detail=e.detail)
+        if e.headers and "Retry-After" in e.headers:
+            ack["retry_after"] = int(e.headers["Retry-After"])
+    except StaleGameError:
+        ack.update(success=False, status=409, detail="Room was updated concurrently, please retry")
+    except Exception as e:
+        logger.error(f"Unexpected error in {kind} command from {connection.player_id}: {e}")
+        ack.update(success=False, status=500, detail="Internal server error")
+    connection.send(json.dumps(ack))
+    
+    if kind == "leave" and ack["success"]:
+        # The ack is still sent, then the socket is closed
+        manager.disconnect(connection.room_id, connection.player_id, connection, close=True)
+
+async def send_snapshot(connection: Connection):
+    """Queue the full state, ordered with respect to the room's broadcasts"""
+    async with room_locks.hold(connection.room_id):
+        game = get_game(connection.room_id)
+        if game:
+            connection.send(encode_snapshot(game, connection.player_id), game.version)
+
+async def send_missed(connection: Connection, since: int):
+    """Queue the room messages a resuming client missed after its version,
+    or a snapshot when they are not all buffered"""
+    async with room_locks.hold(connection.room_id):
+        game = get_game(connection.room_id)
+        if not game:
+            return
+        payloads = [] if since == game.version else None
+        if since < game.version:
+            payloads = manager.missed_payloads(connection.room_id, connection.player_id, since)
+        # Changes after the last message sent only arrive later if a held
+        # update is still to be flushed
+        if payloads is not None and connection.room_id not in manager.pending_updates:
+            if (payloads[-1][0] if payloads else since) < game.version:
+                payloads = None
+        if payloads is None:
+            connection.send(encode_snapshot(game, connection.player_id), game.version)
+            return
+        for version, payload in payloads:
+            connection.send(payload, version)
+
+# Phase transitions shared by HTTP handlers, AI tasks and the phase timer.
+# Callers must hold the room's lock; each helper re-checks the phase so a
+# transition that already happened is not applied again.
+async def begin_voting(room_id: str, game: GameState):
+    """Move a room from responses to voting and schedule the AI vote"""
+    if not game.start_voting_phase():
+        return
+    phase_timer.schedule(room_id, game.timer_end)
+    await publish(room_id, game, "voting_phase_started")
+    
+    # Generate AI vote after delay
+    room_tasks.spawn(room_id, generate_ai_vote_delayed(room_id))
+
+async def finish_voting(room_id: str, game: GameState):
+    """Tally votes, broadcast the results and queue the next round"""
+    if game.phase != "voting":
+        return
+    results = game.calculate_round_results()
+    
+    # Results are already properly serialized from calculate_round_results
+    await publish(room_id, game, "round_results", results=results)
+    
+    # Check win condition and advance to next round after delay
+    room_tasks.spawn(room_id, advance_round_delayed(room_id))
+
+async def handle_phase_timeout(room_id: str, timer_end: float):
+    """Advance a room whose phase timer ran out with players still pending"""
+    try:
+        async with room_locks.hold(room_id):
+            # A player may have completed the phase while we waited for the lock
+            game = get_game(room_id)
+            if not game or game.timer_end != timer_end:
+                return
+            if game.phase == "response":
+                await begin_voting(room_id, game)
+            elif game.phase == "voting":
+                await finish_voting(room_id, game)
+    except Exception as e:
+        logger.error(f"Error handling phase timeout in room {room_id}: {e}")
 
 # Background tasks
 async def generate_ai_response_delayed(room_id: str):
@@ -385,8 +1259,10 @@ async def generate_ai_response_delayed(room_id: str):
     await asyncio.sleep(3 + (hash(room_id) % 10))  # 3-13 second delay
     
     game = get_game(room_id)
-    if not game or game.phase != "response" or not game.ai_player_id:
+    if not game or game.phase != "response" or not game.ai_player_id or game.ai_player_id in game.responses:
         return
+    # What the response is written for; the live game moves on during the model call
+    round_number, prompt = game.current_round, game.prompt
     
     try:
         ai_bot = get_ai_bot()
@@ -401,31 +1277,23 @@ async def generate_ai_response_delayed(room_id: str):
             ai_response = random.choice(fallback_responses)
         else:
             # Get existing responses for context (excluding AI's own if any)
-            human_responses = [r for r in game.responses if r["player_id"] != game.ai_player_id]
-            ai_response = await ai_bot.generate_response(game.prompt, human_responses)
-        
-        game.add_response(game.ai_player_id, ai_response)
+            human_responses = [r for r in game.responses.values() if r.player_id != game.ai_player_id]
+            ai_response = await ai_bot.generate_response(prompt, human_responses)
         
-        # Check if we can advance to voting
-        if game.can_advance_to_voting():
-            game.start_voting_phase()
-            await manager.broadcast_to_room(
-                json.dumps({
-                    "type": "voting_phase_started",
-                    "game_state": game.get_game_state_dict()
-                }),
-                room_id
-            )
-            # Generate AI vote after delay
-            asyncio.create_task(generate_ai_vote_delayed(room_id))
-        else:
-            await manager.broadcast_to_room(
-                json.dumps({
-                    "type": "response_received",
-                    "game_state": game.get_game_state_dict()
-                }),
-                room_id
-            )
+        async with room_locks.hold(room_id):
+            # The phase may have moved on while the response was generated
+            game = get_game(room_id)
+            if (not game or game.phase != "response" or game.current_round != round_number
+                    or game.prompt != prompt or not game.ai_player_id):
+                return
+            if not game.add_response(game.ai_player_id, ai_response):
+                return
+            
+            # Check if we can advance to voting
+            if game.can_advance_to_voting():
+                await begin_voting(room_id, game)
+            else:
+                await publish(room_id, game, "response_received")
     except Exception as e:
         logger.error(f"Error generating AI response: {e}")
 
@@ -434,51 +1302,36 @@ async def generate_ai_vote_delayed(room_id: str):
     await asyncio.sleep(5 + (hash(room_id) % 8))  # 5-13 second delay
     
     game = get_game(room_id)
-    if not game or game.phase != "voting" or not game.ai_player_id:
+    if not game or game.phase != "voting" or not game.ai_player_id or game.ai_player_id in game.votes:
         return
     
     try:
         ai_bot = get_ai_bot()
         if not ai_bot:
             # Simple fallback voting - choose random player
-            alive_players = [p for p in game.players if p["alive"] and not p["is_ai"]]
+            alive_players = [p for p in game.players.values() if p.alive and not p.is_ai]
             if alive_players:
-                target_id = random.choice(alive_players)["id"]
+                target_id = random.choice(alive_players).id
             else:
                 return
         else:
             # Choose target and vote type
-            target_id = ai_bot.choose_vote_target(game.players, game.responses)
+            target_id = ai_bot.choose_vote_target(list(game.players.values()), list(game.responses.values()))
         
         if target_id:
-            game.add_vote(game.ai_player_id, target_id, "kick")
-            
-            # Get serializable game state
-            game_state = game.get_game_state_dict()
-            
-            # Check if we can advance to results
-            if game.can_advance_to_results():
-                results = game.calculate_round_results()
-                
-                # Results are already properly serialized from calculate_round_results
-                await manager.broadcast_to_room(
-                    json.dumps({
-                        "type": "round_results",
-                        "results": results,
-                        "game_state": game_state
-                    }),
-                    room_id
-                )
+            round_number = game.current_round
+            async with room_locks.hold(room_id):
+                game = get_game(room_id)
+                if not game or game.current_round != round_number or not game.ai_player_id:
+                    return
+                if not game.add_vote(game.ai_player_id, target_id, "kick"):
+                    return
                 
-                asyncio.create_task(advance_round_delayed(room_id))
-            else:
-                await manager.broadcast_to_room(
-                    json.dumps({
-                        "type": "vote_received",
-                        "game_state": game_state
-                    }),
-                    room_id
-                )
+                # Check if we can advance to results
+                if game.can_advance_to_results():
+                    await finish_voting(room_id, game)
+                else:
+                    await publish(room_id, game, "vote_received")
     except Exception as e:
         logger.error(f"Error generating AI vote: {e}")
 
@@ -486,51 +1339,167 @@ async def advance_round_delayed(room_id: str):
     """Advance to next round after showing results"""
     await asyncio.sleep(5)  # 5 second delay to show results
     
-    game = get_game(room_id)
-    if not game:
-        return
-    
     try:
-        winner = game.check_win_condition()
-        if winner:
-            game.phase = "game_over"
-            await manager.broadcast_to_room(
-                json.dumps({
-                    "type": "game_over",
-                    "winner": winner,
-                    "game_state": game.get_game_state_dict()
-                }),
-                room_id
-            )
-        else:
-            # Start next round
-            game.next_round()
-            await manager.broadcast_to_room(
-                json.dumps({
-                    "type": "new_round",
-                    "game_state": game.get_game_state_dict()
-                }),
-                room_id
-            )
+        async with room_locks.hold(room_id):
+            # The room may have been reset while results were showing
+            game = get_game(room_id)
+            if not game or game.phase != "results":
+                return
             
-            # Generate AI response for new round
-            asyncio.create_task(generate_ai_response_delayed(room_id))
+            # next_round moves the game to game_over when there is a winner
+            if not game.next_round():
+                await publish(room_id, game, "game_over", winner=game.check_win_condition())
+            else:
+                phase_timer.schedule(room_id, game.timer_end)
+                await publish(room_id, game, "new_round")
+                
+                # Generate AI response for new round
+                room_tasks.spawn(room_id, generate_ai_response_delayed(room_id))
     except Exception as e:
         logger.error(f"Error advancing round: {e}")
 
+async def evict_room(room_id: str):
+    """Release everything still attached to a room removed from the store"""
+    room_tasks.cancel(room_id)
+    await manager.close_room(room_id)
+    logger.info(f"Evicted idle room {room_id}")
+
+async def resume_rooms(rooms: List[Tuple[str, str]]):
+    """Respawn the pending AI and round tasks of restored (room_id, phase) pairs"""
+    for i, (room_id, phase) in enumerate(rooms):
+        # The AI tasks skip rooms where the AI already acted
+        if phase == "response":
+            room_tasks.spawn(room_id, generate_ai_response_delayed(room_id))
+        elif phase == "voting":
+            room_tasks.spawn(room_id, generate_ai_vote_delayed(room_id))
+        elif phase == "results":
+            room_tasks.spawn(room_id, advance_round_delayed(room_id))
+        if i % 1000 == 999:
+            await asyncio.sleep(0)  # Let requests in between batches
+
+# Room snapshots, so in-memory games survive a redeploy. Between snapshots
+# every saved event is journaled, so they survive a crash too.
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH")
+JOURNAL_PATH = SNAPSHOT_PATH + ".journal" if SNAPSHOT_PATH else None
+# Journal size that triggers a new snapshot (and an empty journal)
+JOURNAL_MAX_BYTES = 64 * 1024 * 1024
+
+def resume_stored_rooms():
+    """Re-arm the phase deadlines and AI tasks of the rounds in progress in
+    a persistent store, which outlived the process that ran them"""
+    pending = []
+    try:
+        for room_id, phase, timer_end in store.active_rooms():
+            phase_timer.schedule(room_id, timer_end)
+            pending.append((room_id, phase))
+    except Exception as e:
+        logger.error(f"Error resuming stored rooms after {len(pending)} rooms: {e}")
+    logger.info(f"Resumed {len(pending)} rooms in progress from the store")
+    asyncio.create_task(resume_rooms(pending))
+
+def restore_rooms():
+    """Load the last snapshot and journal, if any, resume their rooms and
+    start journaling"""
+    if store.persistent:
+        resume_stored_rooms()
+        return
+    if not SNAPSHOT_PATH:
+        return
+    start = time.perf_counter()
+    count = 0
+    pending = []
+    
+    def resume(room_id: str, phase: str, timer_end: Optional[float]):
+        phase_timer.schedule(room_id, timer_end)
+        if phase in ("response", "voting", "results"):
+            pending.append((room_id, phase))
+    
+    def resume_entries(entries):
+        nonlocal count
+        for entry in entries:
+            if entry.timer_end is not None:
+                resume(entry.room_id, entry.phase, entry.timer_end)
+            elif entry.phase == "results":
+                pending.append((entry.room_id, entry.phase))
+            count += 1
+            yield entry
+    
+    try:
+        if os.path.exists(SNAPSHOT_PATH):
+            store.restore(resume_entries(read_snapshot(SNAPSHOT_PATH)))
+        # Rooms the journal changed are resumed again from their current
+        # state; the timer and AI tasks ignore whatever is stale
+        for room_id in store.replay_journal(read_journal(JOURNAL_PATH)):
+            game = get_game(room_id)
+            if game:
+                resume(room_id, game.phase, game.timer_end)
+    except Exception as e:
+        logger.error(f"Error restoring rooms after {count} rooms: {e}")
+    # Keep appending to the same journal: until the next snapshot, the old
+    # one plus the journal is what a crash recovers from
+    store.journal = EventJournal(JOURNAL_PATH)
+    logger.info(f"Restored {len(store)} rooms from {SNAPSHOT_PATH} in {time.perf_counter() - start:.2f}s")
+    
+    # Rooms are playable now; their AI actions are respawned in the background
+    asyncio.create_task(resume_rooms(pending))
+
+def snapshot_rooms():
+    """Write every room to the snapshot file and empty the journal"""
+    if not SNAPSHOT_PATH or store.persistent:
+        return
+    start = time.perf_counter()
+    try:
+        count = write_snapshot(SNAPSHOT_PATH, store.snapshot())
+    except Exception as e:
+        logger.error(f"Error writing room snapshot: {e}")
+        return
+    if store.journal:
+        store.journal.truncate()
+    logger.info(f"Saved {count} rooms to {SNAPSHOT_PATH} in {time.perf_counter() - start:.2f}s")
+
 # Cleanup task
+ROOM_SWEEP_INTERVAL = 60  # seconds
+
 @app.on_event("startup")
 async def startup_event():
-    """Start background cleanup task"""
+    """Restore rooms, then start the room broker and background cleanup, phase timer and heartbeat tasks"""
+    restore_rooms()
+    await manager.broker.start()
+    
     async def cleanup_task():
         while True:
-            await asyncio.sleep(3600)  # Run every hour
+            await asyncio.sleep(ROOM_SWEEP_INTERVAL)
             try:
-                cleanup_old_games()
+                for room_id in cleanup_old_games():
+                    await evict_room(room_id)
+                # Rooms another worker evicted from a shared store leave their
+                # buffers here, once their last socket here is gone
+                idle = manager.idle_buffers()
+                if idle:
+                    existing = get_games(idle)
+                    for room_id in idle:
+                        if room_id not in existing:
+                            manager.recent_messages.pop(room_id, None)
+                if store.journal and store.journal.size() > JOURNAL_MAX_BYTES:
+                    snapshot_rooms()
             except Exception as e:
                 logger.error(f"Error during cleanup: {e}")
     
+    async def heartbeat_task():
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            for connection in manager.heartbeat():
+                room_tasks.spawn(connection.room_id, reap_connection(connection))
+    
     asyncio.create_task(cleanup_task())
+    asyncio.create_task(phase_timer.run())
+    asyncio.create_task(heartbeat_task())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Snapshot rooms before the process exits"""
+    snapshot_rooms()
+    await manager.broker.close()
 
 def main():
     """Entry point for the application"""
@@ -542,7 +1511,7 @@ def main():
     
     print(f"Starting server on {host}:{port}")
     
-    uvicorn.run(app, host=host, port=port, reload=False)
+    uvicorn.run(app, host=host, port=port, reload=False, ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""Process-wide prompt catalog, shared by every room.
+
+Prompts are loaded once from a JSON file mapping category names to lists of
+prompts (PROMPTS_PATH, or prompts.json next to this module) and stored as a
+single tuple, each category a contiguous range of it. Rooms never copy
+prompts: a room holds a PromptDeck of four values that walks its category in
+a shuffled order, so drawing is O(1) and per-room memory doesn't depend on
+the size of the catalog.
+"""
+
+import json
+import math
+import os
+import random
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+ALL_PROMPTS = "all"
+
+
+class PromptDeck(NamedTuple):
+	"""A room's position in its shuffled walk over one category.
+
+	The walk visits index (offset + step * drawn) mod n of the category,
+	which with step coprime to n is a permutation: no prompt repeats until
+	all n were drawn, then a new step and offset are picked.
+	"""
+	category: str
+	step: int
+	offset: int
+	drawn: int
+
+
+class PromptCatalog:
+	def __init__(self, categories: Dict[str, List[str]]):
+		prompts: List[str] = []
+		self.categories: Dict[str, range] = {}
+		for name, category_prompts in categories.items():
+			if name == ALL_PROMPTS or not category_prompts:
+				raise ValueError(f"Invalid prompt category: {name}")
+			self.categories[name] = range(len(prompts), len(prompts) + len(category_prompts))
+			prompts.extend(category_prompts)
+		if not prompts:
+			raise ValueError("Prompt catalog is empty")
+		self.prompts: Tuple[str, ...] = tuple(prompts)
+		self.categories[ALL_PROMPTS] = range(len(self.prompts))
+
+	@classmethod
+	def load(cls, path: Path) -> "PromptCatalog":
+		with open(path, encoding="utf-8") as f:
+			return cls(json.load(f))
+
+	def __contains__(self, category: str) -> bool:
+		return category in self.categories
+
+	def category_sizes(self) -> Dict[str, int]:
+		return {name: len(indexes) for name, indexes in self.categories.items()}
+
+	def new_deck(self, category: str = ALL_PROMPTS) -> PromptDeck:
+		"""A freshly shuffled deck over a category, with nothing drawn"""
+		n = len(self.categories[category])
+		step = 1
+		if n > 2:
+			step = random.randrange(1, n)
+			while math.gcd(step, n) != 1:
+				step = random.randrange(1, n)
+		return PromptDeck(category, step, random.randrange(n), 0)
+
+	def draw(self, deck: Optional[PromptDeck]) -> Tuple[str, PromptDeck]:
+		"""Next prompt of a deck (a new deck over every prompt if None) and the advanced deck"""
+		if deck is None or deck.category not in self.categories:
+			deck = self.new_deck()
+		indexes = self.categories[deck.category]
+		if deck.drawn >= len(indexes):
+			deck = self.new_deck(deck.category)
+		index = indexes[(deck.offset + deck.step * deck.drawn) % len(indexes)]
+		return self.prompts[index], deck._replace(drawn=deck.drawn + 1)
+
+
+catalog = PromptCatalog.load(Path(os.getenv("PROMPTS_PATH") or Path(__file__).with_name("prompts.json")))
@@ -0,0 +1,169 @@
+"""Per-client rate limits with token buckets, as ASGI middleware.
+
+Each limited route has token buckets keyed by client IP and/or by the
+player_id in the request body. A bucket holds up to `burst` tokens and
+refills at `rate` tokens a second; a request takes one, or is answered 429
+with Retry-After when there is none. Buckets live in an LRU map of bounded
+size per route, so a flood of distinct keys costs bounded memory: the least
+recently seen key is dropped, and starts over with a full bucket.
+
+Behind a reverse proxy every request comes from the proxy's IP, so requests
+from trusted proxies are keyed by the client they forwarded for instead:
+the last X-Forwarded-For hop that is not itself a trusted proxy.
+"""
+
+import ipaddress
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from starlette.responses import JSONResponse
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_limit(spec: str) -> Optional[Tuple[float, float]]:
+    """Parse "<requests>/<seconds>" into (rate, burst); None when off"""
+    spec = spec.strip()
+    if not spec or spec == "0":
+        return None
+    requests, _, seconds = spec.partition("/")
+    burst = float(requests)
+    return burst / float(seconds or 1), burst
+
+
+def parse_networks(spec: str) -> List[Network]:
+    """Parse comma-separated IPs and CIDR ranges"""
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in spec.split(",") if part.strip()]
+
+
+class TokenBuckets:
+    """Token buckets by key, keeping at most max_keys of them"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, monotonic time they were counted at]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def take(self, key: str) -> float:
+        """Take a token for key: 0 if there was one, else the seconds until there is"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RateLimitMiddleware:
+    """Applies per-IP and per-player buckets to POSTs on their routes"""
+
+    def __init__(self, app, ip_limits: Dict[str, TokenBuckets], player_limits: Dict[str, TokenBuckets],
+                 trusted_proxies: Sequence[Network] = ()):
+        self.app = app
+        self.ip_limits = ip_limits
+        self.player_limits = player_limits
+        self.trusted_proxies = trusted_proxies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        ip_buckets = self.ip_limits.get(path)
+        player_buckets = self.player_limits.get(path)
+        if ip_buckets is None and player_buckets is None:
+            return await self.app(scope, receive, send)
+
+        retry_after = 0.0
+        if ip_buckets is not None:
+            retry_after = ip_buckets.take(self._client_ip(scope))
+        if player_buckets is not None and not retry_after:
+            # The body is read here to find the player, then replayed to the app
+            body = await _read_body(receive)
+            receive = _replay(body, receive)
+            player_id = _player_id(body)
+            if player_id:
+                retry_after = player_buckets.take(player_id)
+
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Too many requests, slow down"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+    def _client_ip(self, scope) -> str:
+        client = scope.get("client")
+        ip = client[0] if client else ""
+        if not self._trusted(ip):
+            return ip
+        # Each proxy appends the address it got the request from
+        hops = [
+            hop.strip()
+            for name, value in scope["headers"] if name == b"x-forwarded-for"
+            for hop in value.decode("latin-1").split(",") if hop.strip()
+        ]
+        for hop in reversed(hops):
+            if not self._trusted(hop):
+                return hop
+        return hops[0] if hops else ip
+
+    def _trusted(self, ip: str) -> bool:
+        if not self.trusted_proxies:
+            return False
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _replay(body: bytes, receive):
+    """A receive that returns the already-read body, then defers to receive"""
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if sent:
+            return await receive()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return replay
+
+
+def _player_id(body: bytes) -> Optional[str]:
+    try:
+        player_id = json.loads(body).get("player_id")
+    except (ValueError, AttributeError):
+        return None
+    return player_id if isinstance(player_id, str) else None
@@ -0,0 +1,94 @@
+"""Binary snapshots of every room, so in-memory games survive a restart.
+
+A snapshot is a magic header followed by one entry per room: a fixed-size
+header with what startup needs to re-arm the room (its code, idle clock,
+phase and phase deadline), then the marshalled GameState.to_snapshot_row().
+Restoring only parses the headers; each room's body is kept as bytes and
+thawed into a GameState the first time the room is used.
+"""
+
+import marshal
+import math
+import mmap
+import os
+import struct
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from .game_logic import GameState
+
+MAGIC = b"BONSNAP1"
+PHASES = ("waiting", "response", "voting", "results", "game_over")
+_PHASE_INDEX = {phase: i for i, phase in enumerate(PHASES)}
+
+# room_id length, last_active_at, phase index, timer_end (NaN if unset), body length
+_ENTRY = struct.Struct("!HdBdI")
+
+
+class SnapshotEntry(NamedTuple):
+	"""One room in a snapshot; times are POSIX seconds"""
+	room_id: str
+	last_active_at: float
+	phase: str
+	timer_end: Optional[float]
+	body: bytes
+
+
+def freeze(game: GameState) -> SnapshotEntry:
+	"""Encode a game as a snapshot entry"""
+	row = game.to_snapshot_row()
+	return SnapshotEntry(game.room_id, row[8], game.phase, row[6], marshal.dumps(row))
+
+
+def thaw(entry: SnapshotEntry) -> GameState:
+	"""Rebuild the game stored in a snapshot entry"""
+	return GameState.from_snapshot_row(marshal.loads(entry.body))
+
+
+def write_snapshot(path: str, entries: Iterable[SnapshotEntry]) -> int:
+	"""Write entries to path atomically and return how many were written"""
+	tmp_path = path + ".tmp"
+	count = 0
+	with open(tmp_path, "wb", buffering=1 << 20) as f:
+		f.write(MAGIC)
+		for entry in entries:
+			room_id = entry.room_id.encode()
+			timer_end = entry.timer_end if entry.timer_end is not None else math.nan
+			f.write(_ENTRY.pack(len(room_id), entry.last_active_at, _PHASE_INDEX[entry.phase], timer_end, len(entry.body)))
+			f.write(room_id)
+			f.write(entry.body)
+			count += 1
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp_path, path)
+	return count
+
+
+def read_snapshot(path: str) -> Iterator[SnapshotEntry]:
+	"""Yield the entries of a snapshot in the order they were written"""
+	with open(path, "rb") as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError(f"{path} is not a room snapshot")
+		size = os.fstat(f.fileno()).st_size
+		if size == len(MAGIC):
+			return
+
+		# Pages are read in as entries are parsed; only the bodies are copied
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			offset = len(MAGIC)
+			unpack_from = _ENTRY.unpack_from
+			header_size = _ENTRY.size
+			while offset < size:
+				if offset + header_size > size:
+					raise ValueError(f"Room snapshot {path} is truncated")
+				id_length, last_active_at, phase, timer_end, body_length = unpack_from(data, offset)
+				offset += header_size
+				room_id = data[offset:offset + id_length].decode()
+				offset += id_length
+				body = data[offset:offset + body_length]
+				offset += body_length
+				if len(body) != body_length:
+					raise ValueError(f"Room snapshot {path} is truncated")
+				yield SnapshotEntry(
+					room_id, last_active_at, PHASES[phase],
+					None if math.isnan(timer_end) else timer_end, body
+				)
@@ -0,0 +1,500 @@
+import heapq
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .game_logic import GameState, RoomCodeAllocator
+from .journal import EventJournal
+from .snapshot import SnapshotEntry, freeze, thaw
+
+# Seconds without player activity before a room is evicted
+ROOM_IDLE_TTL = 30 * 60
+
+# Milliseconds a SQLite write waits for another worker's transaction. Calls
+# block the event loop, so this stays short: a write that gives up raises
+# StaleGameError and the client retries.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 50))
+
+
+def _monotonic_from_wall(timestamp: float) -> float:
+	"""Convert a time.time() timestamp to the time.monotonic() clock"""
+	return time.monotonic() - (time.time() - timestamp)
+
+
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+	"""Whether SQLite gave up waiting for another connection's lock"""
+	return error.sqlite_errorcode in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+class StaleGameError(Exception):
+	"""Raised when saving a game that another writer changed since it was loaded"""
+
+
+class GameStore:
+	"""Where rooms live.
+
+	Writes use optimistic concurrency: get() remembers the version a game was
+	loaded at (GameState.stored_version) and save() only succeeds if the
+	stored copy is still at that version.
+	"""
+
+	# Whether rooms outlive the process without a snapshot
+	persistent = False
+	# Where a non-persistent store journals saved events, if anywhere
+	journal: Optional[EventJournal] = None
+
+	def create(self) -> GameState:
+		"""Create and store an empty room with a fresh code"""
+		raise NotImplementedError
+
+	def get(self, room_id: str) -> Optional[GameState]:
+		raise NotImplementedError
+
+	def get_many(self, room_ids: Iterable[str]) -> Dict[str, GameState]:
+		"""Load several rooms at once; missing rooms are left out"""
+		raise NotImplementedError
+
+	def save(self, game: GameState):
+		"""Persist a mutated game or raise StaleGameError"""
+		raise NotImplementedError
+
+	def cleanup(self, now: Optional[float] = None) -> List[str]:
+		"""Evict rooms idle for longer than ROOM_IDLE_TTL and return their IDs"""
+		raise NotImplementedError
+
+	def snapshot(self) -> Iterator[SnapshotEntry]:
+		"""Every room as a snapshot entry; only needed by non-persistent stores"""
+		raise NotImplementedError
+
+	def restore(self, entries: Iterable[SnapshotEntry]):
+		"""Add rooms from a snapshot under their existing codes"""
+		raise NotImplementedError
+
+	def replay_journal(self, records: Iterable[Tuple[str, int, tuple]]) -> Set[str]:
+		"""Apply journal records on top of restored rooms and return the IDs
+		of the rooms they touched"""
+		raise NotImplementedError
+
+	def active_rooms(self) -> Iterator[Tuple[str, str, Optional[float]]]:
+		"""(room_id, phase, timer_end) of every room with a round in
+		progress; only needed by persistent stores, whose rooms outlive the
+		timers and tasks of the process that ran them"""
+		raise NotImplementedError
+
+	def memory_stats(self, sample: Optional[int] = None) -> Dict:
+		"""Rooms and approximate bytes held in this process, in total and per
+		phase; with sample, bytes are estimated from that many random rooms"""
+		raise NotImplementedError
+
+	def __len__(self) -> int:
+		raise NotImplementedError
+
+
+class InMemoryGameStore(GameStore):
+	"""Rooms as live objects in this process (the default)"""
+
+	def __init__(self):
+		self.games: Dict[str, GameState] = {}
+		self.room_codes = RoomCodeAllocator()
+		# Min-heap of (idle deadline, room_id), one entry per room. Entries are
+		# not updated on activity; a popped entry whose room was active since
+		# is pushed back with its new deadline instead.
+		self._expiry_heap: List[Tuple[float, str]] = []
+		# Rooms restored from a snapshot and not used since, thawed on first get()
+		self._frozen: Dict[str, SnapshotEntry] = {}
+
+	def create(self) -> GameState:
+		room_id = self.room_codes.allocate()
+		game = GameState(room_id)
+		self._add(game)
+		if self.journal:
+			self.journal.append(room_id, 0, ("create", game.created_at))
+			self.journal.flush()
+		return game
+
+	def _add(self, game: GameState):
+		self.games[game.room_id] = game
+		heapq.heappush(self._expiry_heap, (game.last_activity + ROOM_IDLE_TTL, game.room_id))
+
+	def get(self, room_id: str) -> Optional[GameState]:
+		game = self.games.get(room_id)
+		if game is None and room_id in self._frozen:
+			game = self.games[room_id] = thaw(self._frozen.pop(room_id))
+		if game:
+			game.stored_version = game.version
+		return game
+
+	def get_many(self, room_ids: Iterable[str]) -> Dict[str, GameState]:
+		found = {}
+		for room_id in room_ids:
+			game = self.get(room_id)
+			if game:
+				found[room_id] = game
+		return found
+
+	def save(self, game: GameState):
+		current = self.games.get(game.room_id)
+		if current is None:
+			raise StaleGameError(f"Room {game.room_id} no longer exists")
+		# Callers normally mutate the stored object itself; a detached copy
+		# must have been loaded at the version currently stored
+		if current is not game and current.version != game.stored_version:
+			raise StaleGameError(f"Room {game.room_id} changed since it was loaded")
+		self.games[game.room_id] = game
+		events = game.take_events()
+		if self.journal and events:
+			version = game.version - len(events)
+			for event in events:
+				version += 1
+				self.journal.append(game.room_id, version, event)
+			self.journal.flush()
+		game.stored_version = game.version
+
+	def cleanup(self, now: Optional[float] = None) -> List[str]:
+		"""Pop expired heap entries; a sweep costs O(expired log n), not O(rooms)"""
+		if now is None:
+			now = time.monotonic()
+
+		evicted = []
+		while self._expiry_heap and self._expiry_heap[0][0] <= now:
+			_, room_id = heapq.heappop(self._expiry_heap)
+			game = self.games.get(room_id)
+			if game:
+				last_activity = game.last_activity
+			elif room_id in self._frozen:
+				last_activity = _monotonic_from_wall(self._frozen[room_id].last_active_at)
+			else:
+				continue
+
+			deadline = last_activity + ROOM_IDLE_TTL
+			if deadline > now:
+				heapq.heappush(self._expiry_heap, (deadline, room_id))
+				continue
+
+			self._drop(room_id)
+			evicted.append(room_id)
+
+		if self.journal and evicted:
+			for room_id in evicted:
+				self.journal.append(room_id, 0, ("drop",))
+			self.journal.flush()
+		return evicted
+
+	def _drop(self, room_id: str):
+		if self.games.pop(room_id, None) is None:
+			del self._frozen[room_id]
+		self.room_codes.release(room_id)
+
+	def snapshot(self) -> Iterator[SnapshotEntry]:
+		for game in list(self.games.values()):
+			yield freeze(game)
+		# Rooms nobody touched since the last restore are written back as-is
+		yield from list(self._frozen.values())
+
+	def restore(self, entries: Iterable[SnapshotEntry]):
+		reserve = self.room_codes.reserve
+		frozen = self._frozen
+		heap = self._expiry_heap
+		# Idle deadline on the monotonic clock, from the wall-clock last activity
+		offset = _monotonic_from_wall(0) + ROOM_IDLE_TTL
+		for entry in entries:
+			reserve(entry.room_id)
+			frozen[entry.room_id] = entry
+			heap.append((entry.last_active_at + offset, entry.room_id))
+		heapq.heapify(heap)
+
+	def replay_journal(self, records: Iterable[Tuple[str, int, tuple]]) -> Set[str]:
+		touched = set()
+		for room_id, version, event in records:
+			exists = room_id in self.games or room_id in self._frozen
+			if event[0] == "create":
+				if not exists:
+					game = GameState(room_id)
+					game.created_at = event[1]
+					self.room_codes.reserve(room_id)
+					self._add(game)
+			elif event[0] == "drop":
+				if exists:
+					self._drop(room_id)
+			else:
+				game = self.get(room_id)
+				# Records already covered by the snapshot are skipped
+				if game is None or version != game.version + 1:
+					continue
+				game.apply_event(event)
+				game.stored_version = game.version
+			touched.add(room_id)
+		return touched
+
+	def memory_stats(self, sample: Optional[int] = None) -> Dict:
+		"""Walks every room, or only `sample` of them with the bytes of each
+		phase scaled up to its room count; a full walk takes seconds at 100k
+		rooms, so it is meant for benchmarks"""
+		phases: Dict[str, Dict[str, int]] = {}
+		games = self.games.values()
+		if sample is not None and sample < len(self.games):
+			for game in games:
+				stats = phases.setdefault(game.phase, {"rooms": 0, "bytes": 0})
+				stats["rooms"] += 1
+			sizes: Dict[str, List[int]] = {}
+			for game in random.sample(list(games), sample):
+				sizes.setdefault(game.phase, []).append(game.memory_size())
+			for phase, stats in phases.items():
+				walked = sizes.get(phase)
+				if walked:
+					stats["bytes"] = sum(walked) * stats["rooms"] // len(walked)
+		else:
+			sample = None
+			for game in games:
+				stats = phases.setdefault(game.phase, {"rooms": 0, "bytes": 0})
+				stats["rooms"] += 1
+				stats["bytes"] += game.memory_size()
+		# Frozen rooms are their encoded entry until first use
+		frozen = {"rooms": len(self._frozen), "bytes": 0}
+		for entry in self._frozen.values():
+			frozen["bytes"] += sys.getsizeof(entry) + sys.getsizeof(entry.room_id) + sys.getsizeof(entry.body)
+		return {
+			"rooms": len(self),
+			"bytes": sum(stats["bytes"] for stats in phases.values()) + frozen["bytes"],
+			"phases": phases,
+			"frozen": frozen,
+			"sampled": sample,
+		}
+
+	def __len__(self) -> int:
+		return len(self.games) + len(self._frozen)
+
+
+class SQLiteGameStore(GameStore):
+	"""Rooms in a SQLite database in WAL mode, shared by every worker on a host.
+
+	A stand-in for an external shared store: no service to run, but several
+	uvicorn workers can read and write the same rooms concurrently. Calls are
+	synchronous; with WAL and a local file they take tens of microseconds,
+	and reads never wait on writers. A write that finds another worker's
+	transaction in progress waits at most SQLITE_BUSY_TIMEOUT_MS, then fails
+	with StaleGameError like a lost version check.
+
+	Saves append the room's new events to room_events instead of rewriting
+	the room; loads replay them on top of the stored state. Every
+	COMPACT_EVERY versions the state is rewritten and the events dropped.
+	"""
+
+	persistent = True
+
+	# Keep IN (...) lists under SQLite's default host parameter limit
+	_BATCH_SIZE = 500
+	COMPACT_EVERY = 32
+
+	def __init__(self, path: str):
+		self.path = path
+		self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("PRAGMA synchronous=NORMAL")
+		self._conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+		self._conn.execute("PRAGMA foreign_keys=ON")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS rooms ("
+			"room_id TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+			"last_active_at REAL NOT NULL, state TEXT NOT NULL)"
+		)
+		self._conn.execute("CREATE INDEX IF NOT EXISTS rooms_last_active ON rooms (last_active_at)")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS room_events ("
+			"room_id TEXT NOT NULL REFERENCES rooms (room_id) ON DELETE CASCADE, "
+			"version INTEGER NOT NULL, event TEXT NOT NULL, "
+			"PRIMARY KEY (room_id, version)) WITHOUT ROWID"
+		)
+		# Codes are handed out locally; collisions with other workers are
+		# learned on insert and kept reserved
+		self.room_codes = RoomCodeAllocator()
+
+	def _load(self, version: int, state: str, events: Iterable[str]) -> GameState:
+		game = GameState.from_snapshot_row(json.loads(state))
+		for event in events:
+			game.apply_event(json.loads(event))
+		game.stored_version = version
+		return game
+
+	def _resync_codes(self):
+		"""Rebuild the local allocator from the codes actually in use"""
+		self.room_codes = RoomCodeAllocator()
+		for (room_id,) in self._conn.execute("SELECT room_id FROM rooms"):
+			self.room_codes.reserve(room_id)
+
+	def create(self) -> GameState:
+		while True:
+			try:
+				room_id = self.room_codes.allocate()
+			except RuntimeError:
+				# Other workers may have freed codes this one still counts as used
+				self._resync_codes()
+				room_id = self.room_codes.allocate()
+
+			game = GameState(room_id)
+			row = game.to_snapshot_row()
+			try:
+				self._conn.execute(
+					"INSERT INTO rooms (room_id, version, last_active_at, state) VALUES (?, ?, ?, ?)",
+					(room_id, game.version, row[8], json.dumps(row))
+				)
+			except sqlite3.IntegrityError:
+				continue  # Taken by another worker; the code stays reserved here
+			except sqlite3.OperationalError as e:
+				if _is_busy(e):
+					self.room_codes.release(room_id)
+					raise StaleGameError(f"Room store busy creating {room_id}") from e
+				raise
+
+			game.stored_version = game.version
+			return game
+
+	def get(self, room_id: str) -> Optional[GameState]:
+		row = self._conn.execute("SELECT version, state FROM rooms WHERE room_id = ?", (room_id,)).fetchone()
+		if not row:
+			return None
+		events = self._conn.execute(
+			"SELECT event FROM room_events WHERE room_id = ? ORDER BY version", (room_id,)
+		)
+		return self._load(row[0], row[1], (event for (event,) in events))
+
+	def get_many(self, room_ids: Iterable[str]) -> Dict[str, GameState]:
+		room_ids = list(room_ids)
+		found = {}
+		for i in range(0, len(room_ids), self._BATCH_SIZE):
+			batch = room_ids[i:i + self._BATCH_SIZE]
+			placeholders = ",".join("?" * len(batch))
+			events: Dict[str, List[str]] = {}
+			for room_id, event in self._conn.execute(
+				f"SELECT room_id, event FROM room_events WHERE room_id IN ({placeholders}) ORDER BY room_id, version",
+				batch
+			):
+				events.setdefault(room_id, []).append(event)
+			rows = self._conn.execute(
+				f"SELECT room_id, version, state FROM rooms WHERE room_id IN ({placeholders})", batch
+			)
+			for room_id, version, state in rows:
+				found[room_id] = self._load(version, state, events.get(room_id, ()))
+		return found
+
+	def active_rooms(self) -> Iterator[Tuple[str, str, Optional[float]]]:
+		room_ids = [room_id for (room_id,) in self._conn.execute("SELECT room_id FROM rooms")]
+		for i in range(0, len(room_ids), self._BATCH_SIZE):
+			for room_id, game in self.get_many(room_ids[i:i + self._BATCH_SIZE]).items():
+				if game.phase in ("response", "voting", "results"):
+					yield room_id, game.phase, game.timer_end
+
+	def save(self, game: GameState):
+		events = game.take_events()
+		if game.version == game.stored_version:
+			return  # Nothing changed
+
+		last_active_at = time.time() - (time.monotonic() - game.last_activity)
+		# Compact when the save crosses a multiple of COMPACT_EVERY, so at
+		# most that many events pile up per room
+		compact = (
+			len(events) != game.version - game.stored_version
+			or game.version // self.COMPACT_EVERY != game.stored_version // self.COMPACT_EVERY
+		)
+
+		try:
+			self._conn.execute("BEGIN IMMEDIATE")
+		except sqlite3.OperationalError as e:
+			if _is_busy(e):
+				raise StaleGameError(f"Room store busy saving {game.room_id}") from e
+			raise
+		try:
+			if compact:
+				row = game.to_snapshot_row()
+				cursor = self._conn.execute(
+					"UPDATE rooms SET version = ?, last_active_at = ?, state = ? WHERE room_id = ? AND version = ?",
+					(game.version, last_active_at, json.dumps(row), game.room_id, game.stored_version)
+				)
+			else:
+				cursor = self._conn.execute(
+					"UPDATE rooms SET version = ?, last_active_at = ? WHERE room_id = ? AND version = ?",
+					(game.version, last_active_at, game.room_id, game.stored_version)
+				)
+			if cursor.rowcount == 0:
+				raise StaleGameError(f"Room {game.room_id} changed since it was loaded")
+
+			if compact:
+				self._conn.execute("DELETE FROM room_events WHERE room_id = ?", (game.room_id,))
+			else:
+				first = game.stored_version + 1
+				self._conn.executemany(
+					"INSERT INTO room_events (room_id, version, event) VALUES (?, ?, ?)",
+					[(game.room_id, first + i, json.dumps(event)) for i, event in enumerate(events)]
+				)
+			self._conn.execute("COMMIT")
+		except BaseException:
+			self._conn.execute("ROLLBACK")
+			raise
+		game.stored_version = game.version
+
+	def cleanup(self, now: Optional[float] = None) -> List[str]:
+		"""Delete rooms past their idle deadline using the last_active_at index"""
+		# now is monotonic like GameState.last_activity; rows hold wall-clock time
+		wall_now = time.time() if now is None else time.time() + (now - time.monotonic())
+		cutoff = wall_now - ROOM_IDLE_TTL
+
+		try:
+			rows = self._conn.execute(
+				"DELETE FROM rooms WHERE last_active_at <= ? RETURNING room_id", (cutoff,)
+			).fetchall()
+		except sqlite3.OperationalError as e:
+			if _is_busy(e):
+				return []  # Another worker is writing; the next sweep evicts them
+			raise
+		evicted = [room_id for (room_id,) in rows]
+		for room_id in evicted:
+			self.room_codes.release(room_id)
+		return evicted
+
+	def memory_stats(self, sample: Optional[int] = None) -> Dict:
+		# Rooms live in the database; this process only holds loaded copies briefly
+		return {"rooms": 0, "bytes": 0, "phases": {}, "frozen": {"rooms": 0, "bytes": 0}, "sampled": None}
+
+	def __len__(self) -> int:
+		return self._conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0]
+
+
+def make_store(spec: str) -> GameStore:
+	"""Build a store from a GAME_STORE value: "memory" or "sqlite:<path>" """
+	if spec == "memory":
+		return InMemoryGameStore()
+	if spec.startswith("sqlite:"):
+		return SQLiteGameStore(spec[len("sqlite:"):])
+	raise ValueError(f"Unknown GAME_STORE backend: {spec}")
+
+
+store: GameStore = make_store(os.getenv("GAME_STORE", "memory"))
+
+def create_room() -> str:
+	"""Create a new game room with unique ID"""
+	return store.create().room_id
+
+def get_game(room_id: str) -> Optional[GameState]:
+	"""Get game by room ID"""
+	return store.get(room_id)
+
+def get_games(room_ids: Iterable[str]) -> Dict[str, GameState]:
+	"""Get several games in one store round-trip"""
+	return store.get_many(room_ids)
+
+def save_game(game: GameState):
+	"""Persist a mutated game; raises StaleGameError on a concurrent update"""
+	store.save(game)
+
+def room_memory_stats(sample: Optional[int] = None) -> Dict:
+	"""Rooms and approximate bytes held in this process, in total and per
+	phase; with sample, estimated from that many rooms"""
+	return store.memory_stats(sample)
+
+def cleanup_old_games(now: Optional[float] = None) -> List[str]:
+	"""Remove idle games and return their IDs"""
+	return store.cleanup(now)
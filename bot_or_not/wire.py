@@ -0,0 +1,111 @@
+"""WebSocket wire formats, negotiated per connection.
+
+Messages are built once per room event as JSON text, which stays the
+default. A client may instead offer the "bot-or-not.msgpack" subprotocol;
+its frames are then transcoded to MessagePack on the worker holding its
+socket, with player ids replaced by small integer handles. Handles are
+assigned per room by that worker and only mean something to its sockets, so
+a client starts over from the snapshot sent on every (re)connect, whose
+viewer_id is its own handle. Player ids are long and repeated in every
+player, response and vote entry, so handles make up most of the savings.
+
+permessage-deflate is negotiated by the server itself (see
+WS_PER_MESSAGE_DEFLATE) and applies to either format.
+
+Server-Sent Events streams are connections too, with a wire that wraps each
+JSON message in an event whose id is the room version it brings the client
+to, so a reconnecting EventSource resumes through Last-Event-ID.
+
+MessagePack needs the optional msgpack package; without it the subprotocol
+is not offered and every client gets JSON.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import msgpack
+except ImportError:  # Optional dependency
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = "bot-or-not.msgpack"
+
+# Fields of client commands that name a player, sent back as handles
+_PLAYER_FIELDS = ("target_player_id",)
+
+
+class PlayerHandles:
+    """Small integer handles for the player ids of one room, on this worker"""
+
+    def __init__(self):
+        self._handles: Dict[str, int] = {}
+        self._ids: List[str] = []
+
+    def handle(self, player_id: str) -> int:
+        handle = self._handles.get(player_id)
+        if handle is None:
+            handle = self._handles[player_id] = len(self._ids)
+            self._ids.append(player_id)
+        return handle
+
+    def player_id(self, handle: int) -> Optional[str]:
+        if 0 <= handle < len(self._ids):
+            return self._ids[handle]
+        return None
+
+    def compact(self, message: Dict) -> Dict:
+        """Copy of a decoded message with every player id replaced by its handle"""
+        state = message.get("game_state") or message.get("patch") or {}
+        for player in state.get("players", ()):
+            self.handle(player["id"])
+        results = message.get("results")
+        if results and results.get("eliminated_player"):
+            self.handle(results["eliminated_player"]["id"])
+        return self._replace(message)
+
+    def _replace(self, value: Any) -> Any:
+        if value.__class__ is str:
+            return self._handles.get(value, value)
+        if value.__class__ is dict:
+            return {self._handles.get(k, k): self._replace(v) for k, v in value.items()}
+        if value.__class__ is list:
+            return [self._replace(item) for item in value]
+        return value
+
+
+class MsgpackWire:
+    """Transcodes a connection's JSON messages to MessagePack frames"""
+
+    name = "msgpack"
+
+    def __init__(self, handles: PlayerHandles):
+        self.handles = handles
+
+    def encode(self, message: str, viewer: Optional[str] = None, version: Optional[int] = None) -> bytes:
+        return msgpack.packb(self.handles.compact(json.loads(message)))
+
+    def decode(self, frame: bytes) -> Dict:
+        message = msgpack.unpackb(frame)
+        for name in _PLAYER_FIELDS:
+            value = message.get(name)
+            if value.__class__ is int:
+                message[name] = self.handles.player_id(value)
+        return message
+
+
+class SSEWire:
+    """Wraps a connection's JSON messages in Server-Sent Events"""
+
+    name = "sse"
+
+    def encode(self, message: str, viewer: Optional[str] = None, version: Optional[int] = None) -> str:
+        if version is None:
+            return "data: " + message + "\n\n"
+        return f"id: {version}\ndata: " + message + "\n\n"
+
+
+def choose_subprotocol(offered: Sequence[str]) -> Optional[str]:
+    """The subprotocol to accept from those a client offered, None for JSON"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    return None
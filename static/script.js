@@ -4,10 +4,26 @@ class BotOrNotGame {
     constructor() {
         this.gameState = null;
         this.playerId = null;
+        // The id the game state shows us under: our own, except during a
+        // game, when players only see each other's in-game ids
+        this.viewerId = null;
         this.roomId = null;
         this.websocket = null;
+        // Server-Sent Events stream, used instead when WebSockets are blocked
+        this.eventSource = null;
         this.timer = null;
         this.playerName = null;
+        // Commands sent over the WebSocket and waiting for their ack, by id
+        this.pendingCommands = new Map();
+        this.nextCommandId = 1;
+        // The last round_results received, with the round they belong to
+        this.lastResults = null;
+        // Reconnect attempts since the socket last opened
+        this.reconnectAttempts = 0;
+        // Whether a WebSocket has opened since the page loaded; until one
+        // has, this many failures to open switch us to Server-Sent Events
+        this.webSocketOpened = false;
+        this.fallbackAfterAttempts = 2;
         
         this.initializeEventListeners();
         this.loadSessionData();
@@ -57,6 +73,7 @@ class BotOrNotGame {
     clearSession() {
         localStorage.removeItem('botOrNotSession');
         this.playerId = null;
+        this.viewerId = null;
         this.roomId = null;
         this.playerName = null;
     }
@@ -70,36 +87,22 @@ class BotOrNotGame {
         this.showLoading(true);
         try {
             // Check if room still exists and player is still in it
-            const response = await fetch(`/room/${this.roomId}`);
+            const response = await fetch(`/room/${this.roomId}?player_id=${encodeURIComponent(this.playerId)}`);
             if (!response.ok) {
                 throw new Error('Room no longer exists');
             }
             
-            const gameState = await response.json();
-            const playerExists = gameState.players.find(p => p.id === this.playerId);
-            
-            if (!playerExists) {
+            // Only players still in the room are told their viewer_id
+            const data = await response.json();
+            if (!data.viewer_id) {
                 throw new Error('Player no longer in room');
             }
             
-            this.gameState = gameState;
+            this.gameState = data.game_state;
+            this.viewerId = data.viewer_id;
             this.connectWebSocket();
-            
-            // Navigate to appropriate screen based on game state
-            if (gameState.phase === 'waiting') {
-                this.showLobby();
-            } else if (gameState.phase === 'game_over') {
-                this.showGameOver(gameState.winner);
-            } else {
-                this.showGame();
-                if (gameState.phase === 'voting') {
-                    this.showVotingPhase();
-                } else if (gameState.phase === 'results') {
-                    this.showResults({ /* results from gameState */ });
-                }
-                this.startTimer();
-            }
-            
+            this.showCurrentPhase();
+
             this.showToast('Reconnected to game', 'success');
         } catch (error) {
             console.error('Reconnection failed:', error);
@@ -250,6 +253,7 @@ class BotOrNotGame {
         const data = await response.json();
         this.roomId = data.room_id;
         this.playerId = data.player_id;
+        this.viewerId = data.viewer_id;
         this.playerName = playerName;
         this.gameState = data.game_state;
         
@@ -285,6 +289,7 @@ class BotOrNotGame {
             const data = await response.json();
             this.roomId = data.room_id;
             this.playerId = data.player_id;
+            this.viewerId = data.viewer_id;
             this.playerName = playerName;
             this.gameState = data.game_state;
             
@@ -305,14 +310,7 @@ class BotOrNotGame {
         
         try {
             // Notify server that player is leaving
-            await fetch('/leave-room', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    room_id: this.roomId,
-                    player_id: this.playerId
-                })
-            });
+            await this.sendCommand('leave', {}, '/leave-room');
         } catch (error) {
             console.error('Error leaving room:', error);
         }
@@ -322,6 +320,10 @@ class BotOrNotGame {
             this.websocket.close();
             this.websocket = null;
         }
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
         
         this.clearTimer();
         this.hideSpectatorMode();
@@ -343,7 +345,7 @@ class BotOrNotGame {
             const response = await fetch('/reset-room', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ room_id: this.roomId })
+                body: JSON.stringify({ room_id: this.roomId, player_id: this.playerId })
             });
             
             if (!response.ok) {
@@ -352,6 +354,7 @@ class BotOrNotGame {
             
             const data = await response.json();
             this.gameState = data.game_state;
+            this.viewerId = data.viewer_id;
             
             this.clearTimer();
             this.hideSpectatorMode();
@@ -366,14 +369,26 @@ class BotOrNotGame {
 
     connectWebSocket() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws/${this.roomId}/${this.playerId}`;
+        let wsUrl = `${protocol}//${window.location.host}/ws/${this.roomId}/${this.playerId}`;
+        // With a state to resume from, the server sends only what we missed
+        if (this.gameState && this.gameState.version !== undefined) {
+            wsUrl += `?since=${this.gameState.version}`;
+        }
         
         console.log('Connecting WebSocket to:', wsUrl); // Debug log
         
-        this.websocket = new WebSocket(wsUrl);
+        const socket = new WebSocket(wsUrl);
+        this.websocket = socket;
         
         this.websocket.onopen = () => {
             console.log('WebSocket connected');
+            this.webSocketOpened = true;
+            this.reconnectAttempts = 0;
+            // Back from the fallback; the socket resumed from our version
+            if (this.eventSource) {
+                this.eventSource.close();
+                this.eventSource = null;
+            }
             this.showToast('Connected to game', 'success');
         };
         
@@ -382,62 +397,218 @@ class BotOrNotGame {
             this.handleWebSocketMessage(message);
         };
         
-        this.websocket.onclose = () => {
+        this.websocket.onclose = (event) => {
             console.log('WebSocket disconnected');
-            this.showToast('Disconnected from game', 'warning');
+            this.pendingCommands.forEach(({ reject }) => reject(new Error('Connection lost')));
+            this.pendingCommands.clear();
+            
+            if (this.websocket !== socket) return;
+            
+            // WebSockets that never open in this session are likely blocked by
+            // a proxy: stream events meanwhile, and keep trying the socket
+            if (!this.webSocketOpened && this.reconnectAttempts + 1 >= this.fallbackAfterAttempts && !this.eventSource) {
+                this.connectEventStream();
+            }
+            if (!this.eventSource) {
+                this.showToast('Disconnected from game', 'warning');
+            }
+            
+            // Reconnect unless we closed the socket, left, or the room was closed
+            if (event.code !== 1000 && event.code !== 1001) {
+                this.scheduleReconnect();
+            }
         };
         
         this.websocket.onerror = (error) => {
             console.error('WebSocket error:', error);
-            this.showToast('Connection error', 'error');
+            // Retries while on the event stream fail quietly
+            if (!this.eventSource) {
+                this.showToast('Connection error', 'error');
+            }
         };
     }
 
+    connectEventStream() {
+        // Fallback for networks that block WebSocket upgrades: the same
+        // messages as Server-Sent Events, while commands go over HTTP. The
+        // browser reconnects by itself, resuming after the last event id
+        let url = `/events/${this.roomId}/${this.playerId}`;
+        if (this.gameState && this.gameState.version !== undefined) {
+            url += `?since=${this.gameState.version}`;
+        }
+        console.log('Connecting event stream to:', url);
+        
+        this.eventSource = new EventSource(url);
+        this.eventSource.onmessage = (event) => {
+            this.handleWebSocketMessage(JSON.parse(event.data));
+        };
+    }
+    
+    scheduleReconnect() {
+        // Exponential backoff with jitter, so a server restart isn't met by
+        // every client at once
+        const delay = Math.min(30000, 1000 * 2 ** this.reconnectAttempts) * (0.5 + Math.random() / 2);
+        this.reconnectAttempts++;
+        setTimeout(() => {
+            if (this.roomId && this.playerId && this.websocket && this.websocket.readyState === WebSocket.CLOSED) {
+                this.connectWebSocket();
+            }
+        }, delay);
+    }
+    
     handleWebSocketMessage(message) {
         console.log('WebSocket message:', message);
         
+        if (message.type === 'ack') {
+            this.handleCommandAck(message);
+            return;
+        }
+        
+        // Server heartbeat; a socket that stops answering is dropped
+        if (message.type === 'ping') {
+            if (this.websocket && this.websocket.readyState === WebSocket.OPEN) {
+                this.websocket.send(JSON.stringify({ type: 'pong' }));
+            }
+            return;
+        }
+        
+        // Events carry either a full game_state or a patch against our version
+        const previous = this.gameState;
+        if (message.patch) {
+            if (!this.applyPatch(message.patch)) return;
+        } else if (message.game_state) {
+            this.gameState = message.game_state;
+        }
+        // Snapshots and game_started tell each player their id; in the lobby
+        // and once the game is over, everyone is shown under their own
+        if (message.viewer_id) {
+            this.viewerId = message.viewer_id;
+        } else if (message.game_state && ['waiting', 'game_over'].includes(message.game_state.phase)) {
+            this.viewerId = this.playerId;
+        }
+
         switch (message.type) {
+            case 'snapshot':
+                // A snapshot stands in for any phase changes we missed
+                if (previous && previous.phase === this.gameState.phase &&
+                    previous.current_round === this.gameState.current_round) {
+                    this.updateUI();
+                } else {
+                    this.showCurrentPhase();
+                }
+                break;
+                
             case 'player_joined':
-                this.gameState = message.game_state;
                 this.updateUI();
                 this.showToast('A player joined the game', 'info');
                 break;
             case 'response_received':
             case 'vote_received':
-                this.gameState = message.game_state;
+            case 'player_left':
+            case 'player_presence':
                 this.updateUI();
                 break;
                 
             case 'game_started':
-                this.gameState = message.game_state;
+                this.lastResults = null;
                 this.showGame();
                 this.startTimer();
                 break;
                 
             case 'voting_phase_started':
-                this.gameState = message.game_state;
                 this.showVotingPhase();
                 this.startTimer();
                 break;
                 
             case 'round_results':
-                this.gameState = message.game_state;
+                this.lastResults = { round: this.gameState.current_round, results: message.results };
                 this.showResults(message.results);
                 break;
                 
             case 'new_round':
-                this.gameState = message.game_state;
                 this.showResponsePhase();
                 this.startTimer();
                 break;
                 
             case 'game_over':
-                this.gameState = message.game_state;
                 this.showGameOver(message.winner);
                 break;
         }
     }
     
+    applyPatch(patch) {
+        // Patches hold whole records, so they apply to any version >= base_version
+        if (!this.gameState || (this.gameState.version || 0) < patch.base_version) {
+            this.requestSync();
+            return false;
+        }
+        if (this.gameState.version >= patch.version) return false;
+        
+        patch.players.forEach(player => {
+            const index = this.gameState.players.findIndex(p => p.id === player.id);
+            if (index >= 0) {
+                this.gameState.players[index] = player;
+            } else {
+                this.gameState.players.push(player);
+            }
+        });
+        if (patch.removed_players.length) {
+            this.gameState.players = this.gameState.players.filter(p => !patch.removed_players.includes(p.id));
+        }
+        
+        Object.assign(this.gameState, patch.state);
+        this.gameState.version = patch.version;
+        return true;
+    }
+    
+    sendCommand(type, fields, fallbackUrl) {
+        // Player actions go over the open socket; the new state arrives as the
+        // usual broadcast, so the ack only says whether the action was accepted
+        if (this.websocket && this.websocket.readyState === WebSocket.OPEN) {
+            const id = this.nextCommandId++;
+            return new Promise((resolve, reject) => {
+                this.pendingCommands.set(id, { resolve, reject });
+                this.websocket.send(JSON.stringify({ type, id, ...fields }));
+            });
+        }
+        return this.postCommand(fallbackUrl, fields);
+    }
+    
+    async postCommand(url, fields) {
+        // Same action over HTTP, while the socket is not connected
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ room_id: this.roomId, player_id: this.playerId, ...fields })
+        });
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            throw new Error(error.detail || 'Request failed');
+        }
+    }
+    
+    handleCommandAck(ack) {
+        const pending = this.pendingCommands.get(ack.id);
+        if (!pending) return;
+        this.pendingCommands.delete(ack.id);
+        if (ack.success) {
+            pending.resolve();
+        } else {
+            pending.reject(new Error(ack.detail || 'Request failed'));
+        }
+    }
+    
+    requestSync() {
+        // Ask the server for a full snapshot after missing an update
+        if (this.websocket && this.websocket.readyState === WebSocket.OPEN) {
+            this.websocket.send(JSON.stringify({ type: 'sync' }));
+        } else if (this.eventSource) {
+            // Streams are one-way: reopen it from our version instead
+            this.eventSource.close();
+            this.connectEventStream();
+        }
+    }
+    
     showLobby() {
         console.log('Showing lobby with room:', this.roomId); // Debug log
         
@@ -485,12 +656,14 @@ class BotOrNotGame {
             
             playerCard.className = cardClass;
             
-            const isCurrentPlayer = player.id === this.playerId;
+            const isCurrentPlayer = player.id === this.viewerId;
             const playerIndicator = isCurrentPlayer ? ' (You)' : '';
             
             let statusText = 'Ready';
             if (!player.alive) {
                 statusText = 'Eliminated';
+            } else if (player.disconnected) {
+                statusText = 'Offline';
             }
             
             playerCard.innerHTML = `
@@ -519,8 +692,8 @@ class BotOrNotGame {
     }
 
     isPlayerAlive() {
-        if (!this.gameState || !this.playerId) return false;
-        const currentPlayer = this.gameState.players.find(p => p.id === this.playerId);
+        if (!this.gameState || !this.viewerId) return false;
+        const currentPlayer = this.gameState.players.find(p => p.id === this.viewerId);
         return currentPlayer ? currentPlayer.alive : false;
     }
 
@@ -654,7 +827,7 @@ class BotOrNotGame {
             responseDiv.className = 'response-item';
             
             // Only make clickable for alive players voting on others
-            if (isAlive && response.player_id !== this.playerId) {
+            if (isAlive && response.player_id !== this.viewerId) {
                 responseDiv.classList.add('clickable');
                 responseDiv.innerHTML = `
                     <div class="response-text">${response.text}</div>
@@ -665,7 +838,7 @@ class BotOrNotGame {
                 responseDiv.addEventListener('click', () => {
                     this.selectResponseVote(responseDiv, response.player_id);
                 });
-            } else if (response.player_id === this.playerId) {
+            } else if (response.player_id === this.viewerId) {
                 // Own response
                 responseDiv.classList.add('own-response');
                 responseDiv.innerHTML = `
@@ -720,11 +893,11 @@ class BotOrNotGame {
                     <p>${wasAI ? '🎉 It was the AI! Good job!' : '😬 It was a human player...'}</p>
                 </div>
             `;
-        } else {
+        } else if (results.eliminated_player !== undefined) {
             resultsHTML += `
                 <div class="elimination-result">
                     <h4>No one was eliminated this round</h4>
-                    <p>Not enough votes to eliminate anyone</p>
+                    <p>Not enough votes to eliminate anyone, or they were protected by trust</p>
                 </div>
             `;
         }
@@ -734,7 +907,9 @@ class BotOrNotGame {
             const player = this.gameState.players.find(p => p.id === playerId);
             if (player) {
                 const displayName = player.display_name || player.name;
-                resultsHTML += `<p>${displayName}: ${voteCount} votes</p>`;
+                const trustCount = (results.trust_counts || {})[playerId] || 0;
+                const trustText = trustCount ? `, ${trustCount} trust` : '';
+                resultsHTML += `<p>${displayName}: ${voteCount} votes${trustText}</p>`;
             }
         }
         resultsHTML += '</div>';
@@ -827,6 +1002,7 @@ class BotOrNotGame {
         // Clear all game state first
         this.gameState = null;
         this.playerId = null;
+        this.viewerId = null;
         this.roomId = null;
         this.selectedVoteTarget = null;
         
@@ -835,6 +1011,10 @@ class BotOrNotGame {
             this.websocket.close();
             this.websocket = null;
         }
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
         
         // Clear timer
         this.clearTimer();
@@ -879,6 +1059,42 @@ class BotOrNotGame {
         }
     }
     
+    showCurrentPhase() {
+        // Navigate to the screen for the phase the game state is in
+        const state = this.gameState;
+        if (state.phase === 'waiting') {
+            this.showLobby();
+        } else if (state.phase === 'game_over') {
+            this.showGameOver(state.winner);
+        } else {
+            this.showGame();
+            if (state.phase === 'voting') {
+                this.showVotingPhase();
+            } else if (state.phase === 'results') {
+                this.showResults(this.resultsFromState());
+            }
+            this.startTimer();
+        }
+    }
+
+    resultsFromState() {
+        // The round's results as broadcast, or the vote tallies when we missed them
+        if (this.lastResults && this.lastResults.round === this.gameState.current_round) {
+            return this.lastResults.results;
+        }
+        const results = { vote_counts: {}, trust_counts: {} };
+        (this.gameState.votes || []).forEach(vote => {
+            const counts = vote.type === 'trust' ? results.trust_counts : results.vote_counts;
+            counts[vote.target_id] = (counts[vote.target_id] || 0) + 1;
+        });
+        this.gameState.players.forEach(player => {
+            if (player.alive) {
+                results.vote_counts[player.id] = results.vote_counts[player.id] || 0;
+            }
+        });
+        return results;
+    }
+
     updateUI() {
         const currentScreen = document.querySelector('.screen.active').id;
         
@@ -928,17 +1144,7 @@ class BotOrNotGame {
     
     async startGame() {
         try {
-            const response = await fetch('/start-game', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ room_id: this.roomId })
-            });
-            
-            if (!response.ok) {
-                const error = await response.json();
-                throw new Error(error.detail || 'Failed to start game');
-            }
-            
+            await this.sendCommand('start_game', {}, '/start-game');
             this.showToast('Game started!', 'success');
         } catch (error) {
             this.showToast(error.message, 'error');
@@ -1011,7 +1217,7 @@ class BotOrNotGame {
         if (!this.gameState) return;
         
         const totalPlayers = this.gameState.alive_players;
-        const submittedResponses = this.gameState.responses.length;
+        const submittedResponses = this.gameState.response_count ?? this.gameState.responses.length;
         
         const statusDiv = document.getElementById('responses-status');
         statusDiv.innerHTML = `${submittedResponses}/${totalPlayers} responses submitted`;
@@ -1050,20 +1256,7 @@ class BotOrNotGame {
         }
         
         try {
-            const response = await fetch('/submit-response', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    room_id: this.roomId,
-                    player_id: this.playerId,
-                    response_text: responseText
-                })
-            });
-            
-            if (!response.ok) {
-                const error = await response.json();
-                throw new Error(error.detail || 'Failed to submit response');
-            }
+            await this.sendCommand('submit_response', { response_text: responseText }, '/submit-response');
             
             document.getElementById('submit-response').disabled = true;
             document.getElementById('response-input').disabled = true;
@@ -1092,20 +1285,7 @@ class BotOrNotGame {
     
     async submitVote(targetPlayerId) {
         try {
-            const response = await fetch('/submit-vote', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    room_id: this.roomId,
-                    player_id: this.playerId,
-                    target_player_id: targetPlayerId,
-                    vote_type: 'kick'
-                })
-            });
-            
-            if (!response.ok) {
-                throw new Error('Failed to submit vote');
-            }
+            await this.sendCommand('submit_vote', { target_player_id: targetPlayerId, vote_type: 'kick' }, '/submit-vote');
             
             // Disable all response items after voting
             document.querySelectorAll('.response-item.clickable').forEach(item => {
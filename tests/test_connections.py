@@ -0,0 +1,71 @@
+"""Sockets to rooms that do not exist leave nothing behind, and resuming
+ones catch up on everything they missed"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from bot_or_not import main
+
+
+def test_player_socket_to_an_unknown_room_is_refused():
+    client = TestClient(main.app)
+    for i in range(10):
+        with pytest.raises(WebSocketDisconnect):
+            with client.websocket_connect(f"/ws/bogus-{i}/player"):
+                pass
+
+    assert not any(room_id.startswith("bogus-") for room_id in main.manager.recent_messages)
+    assert not any(room_id.startswith("bogus-") for room_id in main.manager.active_connections)
+
+
+def test_connection_stats_need_the_stats_token(monkeypatch):
+    client = TestClient(main.app)
+    assert client.get("/stats/connections").status_code == 404
+
+    monkeypatch.setattr(main, "STATS_TOKEN", "s3cret")
+    assert client.get("/stats/connections").status_code == 403
+    response = client.get("/stats/connections", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert "rooms" in response.json()
+
+
+def test_resume_past_the_last_buffered_message_gets_a_snapshot():
+    client = TestClient(main.app)
+    created = client.post("/create-room", json={"player_name": "Ann"}).json()
+    room_id = created["room_id"]
+
+    with client.websocket_connect(f"/ws/{room_id}/{created['player_id']}") as socket:
+        socket.receive_text()
+        joined = client.post("/join-room", json={"room_id": room_id, "player_name": "Bob"}).json()
+        buffered = json.loads(socket.receive_text())
+        assert buffered["type"] == "player_joined"
+        # A change that was saved but never broadcast
+        game = main.get_game(room_id)
+        game.add_player("player-x", "Cy")
+        main.save_game(game)
+        version = game.version
+
+        with client.websocket_connect(f"/ws/{room_id}/{joined['player_id']}?since={buffered['patch']['version']}") as resumed:
+            message = json.loads(resumed.receive_text())
+
+    assert message["type"] == "snapshot"
+    assert message["game_state"]["version"] == version
+
+
+def test_msgpack_resume_starts_from_a_snapshot():
+    msgpack = pytest.importorskip("msgpack")
+    client = TestClient(main.app)
+    created = client.post("/create-room", json={"player_name": "Ann"}).json()
+    room_id, player_id = created["room_id"], created["player_id"]
+    version = main.get_game(room_id).version
+
+    url = f"/ws/{room_id}/{player_id}?since={version}"
+    with client.websocket_connect(url, subprotocols=["bot-or-not.msgpack"]) as socket:
+        message = msgpack.unpackb(socket.receive_bytes())
+
+    # The snapshot names players by this worker's current handles
+    assert message["type"] == "snapshot"
+    assert message["viewer_id"] == message["game_state"]["players"][0]["id"]
@@ -0,0 +1,64 @@
+"""GameState transitions that depend on how players come and go"""
+
+from bot_or_not.game_logic import GameState
+
+PLAYERS = 4
+
+
+def started_game():
+    game = GameState("123456")
+    for i in range(PLAYERS):
+        game.add_player(f"player-{i}", f"Player {i}")
+    game.start_game()
+    return game
+
+
+def test_reset_keeps_players_whose_connection_dropped():
+    game = started_game()
+    game.set_presence("player-0", False)
+    game.reset_to_lobby()
+
+    assert "player-0" in game.players
+    assert game.players["player-0"].disconnected
+
+
+def test_reset_drops_players_who_left():
+    game = started_game()
+    game.remove_player("player-1")
+    # A socket still open for them does not bring them back
+    assert not game.set_presence("player-1", True)
+    game.reset_to_lobby()
+
+    assert "player-1" not in game.players
+    assert len(game.players) == PLAYERS - 1
+
+
+def test_left_survives_a_snapshot_round_trip():
+    game = started_game()
+    game.remove_player("player-1")
+    game.set_presence("player-2", False)
+    restored = GameState.from_snapshot_row(game.to_snapshot_row())
+
+    assert restored.players["player-1"].left
+    assert not restored.players["player-2"].left
+    assert restored.players["player-2"].disconnected
+
+
+
+def test_lobby_ids_are_only_shown_once_the_game_is_over():
+    game = started_game()
+    game.add_response("player-0", "an answer")
+    game.start_voting_phase()
+    game.add_vote("player-0", game.ai_player_id, "kick")
+    results = game.calculate_round_results()
+
+    lobby_ids = set(game.players)
+    for audience in ("player", "spectator"):
+        view = game.get_game_state_json(audience)
+        assert not any(player_id in view for player_id in lobby_ids)
+    assert not lobby_ids & set(results["vote_counts"])
+    assert results["eliminated_player"]["id"] not in lobby_ids
+    assert game.player_id_for(game.players["player-1"].public_id) == "player-1"
+
+    assert not game.next_round()
+    assert all(player_id in game.get_game_state_json("reveal") for player_id in lobby_ids)
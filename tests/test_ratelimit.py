@@ -0,0 +1,51 @@
+"""Per-IP limits key clients behind trusted proxies by their forwarded address"""
+
+import asyncio
+
+from bot_or_not.ratelimit import RateLimitMiddleware, TokenBuckets, parse_networks
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def post(middleware, peer, forwarded_for=None):
+    """Status of a POST /create-room from peer through the middleware"""
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    scope = {"type": "http", "method": "POST", "path": "/create-room", "client": (peer, 1234), "headers": headers}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent[0]["status"]
+
+
+def limited(trusted=""):
+    buckets = TokenBuckets(rate=1 / 60, burst=1, max_keys=100)
+    return RateLimitMiddleware(ok_app, {"/create-room": buckets}, {}, parse_networks(trusted))
+
+
+def test_clients_behind_a_trusted_proxy_get_their_own_buckets():
+    middleware = limited("172.16.0.0/12")
+    assert post(middleware, "172.18.0.2", "203.0.113.1") == 200
+    assert post(middleware, "172.18.0.2", "203.0.113.2") == 200
+    assert post(middleware, "172.18.0.2", "203.0.113.1") == 429
+
+
+def test_forwarded_for_is_ignored_from_untrusted_peers():
+    middleware = limited("172.16.0.0/12")
+    assert post(middleware, "198.51.100.7", "203.0.113.1") == 200
+    # A client can't pick a fresh address for itself
+    assert post(middleware, "198.51.100.7", "203.0.113.2") == 429
+
+
+def test_spoofed_hops_before_the_proxy_are_skipped():
+    middleware = limited("172.16.0.0/12")
+    assert post(middleware, "172.18.0.2", "10.9.9.9, 203.0.113.1") == 200
+    assert post(middleware, "172.18.0.2", "10.9.9.8, 203.0.113.1") == 429
@@ -0,0 +1,41 @@
+"""Rounds in progress pick up their timers and AI tasks after a restart"""
+
+import asyncio
+
+import pytest
+
+from bot_or_not import main, store as store_module
+from bot_or_not.store import SQLiteGameStore
+
+
+@pytest.fixture
+def sqlite_store(tmp_path, monkeypatch):
+    store = SQLiteGameStore(str(tmp_path / "rooms.db"))
+    monkeypatch.setattr(store_module, "store", store)
+    monkeypatch.setattr(main, "store", store)
+    return store
+
+
+@pytest.mark.asyncio
+async def test_rooms_in_a_persistent_store_are_rearmed_on_startup(sqlite_store, monkeypatch):
+    lobby = sqlite_store.create()
+    playing = sqlite_store.create()
+    for i in range(4):
+        playing.add_player(f"player-{i}", f"Player {i}")
+    playing.start_game()
+    sqlite_store.save(playing)
+
+    scheduled = []
+    spawned = []
+    monkeypatch.setattr(main.phase_timer, "schedule", lambda room_id, timer_end: scheduled.append((room_id, timer_end)))
+
+    async def resume_rooms(rooms):
+        spawned.extend(rooms)
+
+    monkeypatch.setattr(main, "resume_rooms", resume_rooms)
+    main.restore_rooms()
+    await asyncio.sleep(0)
+
+    assert scheduled == [(playing.room_id, playing.timer_end)]
+    assert spawned == [(playing.room_id, "response")]
+    assert lobby.room_id not in dict(spawned)
@@ -0,0 +1,100 @@
+"""Room transitions are applied exactly once when commands and tasks race"""
+
+import asyncio
+import json
+
+import pytest
+
+from bot_or_not import main
+from bot_or_not.store import create_room, get_game
+
+PLAYERS = 4
+
+
+@pytest.fixture
+def events(monkeypatch):
+    """Types of the events broadcast to players, in order"""
+    sent = []
+
+    async def broadcast_to_room(message, room_id, exclude_player=None):
+        # Yield like a real broadcast, so racing commands interleave here
+        await asyncio.sleep(0)
+        sent.append(json.loads(message.payloads["player"])["type"])
+
+    monkeypatch.setattr(main.manager, "broadcast_to_room", broadcast_to_room)
+    monkeypatch.setattr(main, "get_ai_bot", lambda: None)
+    yield sent
+
+
+@pytest.fixture
+def room(events):
+    """A room of humans and the AI in the voting phase"""
+    room_id = create_room()
+    game = get_game(room_id)
+    for i in range(PLAYERS):
+        game.add_player(f"player-{i}", f"Player {i}")
+    game.start_game()
+    for player_id in list(game.players):
+        game.add_response(player_id, "Probably something involving snacks")
+    game.start_voting_phase()
+    yield room_id
+    main.room_tasks.cancel(room_id)
+
+
+def kick_next(game):
+    """(voter, target) pairs where every player kicks the next one, named
+    by their in-game id as clients do"""
+    players = game.get_alive_players()
+    return [(voter.id, players[(i + 1) % len(players)].public_id) for i, voter in enumerate(players)]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_votes_emit_one_round_results(room, events):
+    game = get_game(room)
+    await asyncio.gather(*(
+        main.submit_vote_command(room, voter, target, "kick")
+        for voter, target in kick_next(game)
+    ))
+
+    assert events.count("round_results") == 1
+    assert game.phase == "results"
+
+
+@pytest.mark.asyncio
+async def test_votes_racing_the_phase_timeout_emit_one_round_results(room, events):
+    game = get_game(room)
+    votes = [
+        main.submit_vote_command(room, voter, target, "kick")
+        for voter, target in kick_next(game)
+    ]
+    await asyncio.gather(*votes, main.handle_phase_timeout(room, game.timer_end), return_exceptions=True)
+
+    assert events.count("round_results") == 1
+
+
+@pytest.mark.asyncio
+async def test_ai_response_for_a_finished_round_is_dropped(events, monkeypatch):
+    room_id = create_room()
+    game = get_game(room_id)
+    for i in range(PLAYERS):
+        game.add_player(f"player-{i}", f"Player {i}")
+    game.start_game()
+
+    class SlowBot:
+        async def generate_response(self, prompt, responses):
+            # The round ends and the next one starts during the model call
+            game.start_voting_phase()
+            game.calculate_round_results()
+            game.next_round()
+            return "An answer to the old prompt"
+
+    sleep = asyncio.sleep
+    monkeypatch.setattr(main, "get_ai_bot", SlowBot)
+    monkeypatch.setattr(asyncio, "sleep", lambda delay: sleep(0))
+    try:
+        await main.generate_ai_response_delayed(room_id)
+    finally:
+        main.room_tasks.cancel(room_id)
+
+    assert game.current_round == 2
+    assert game.ai_player_id not in game.responses